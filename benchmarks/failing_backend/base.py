@@ -0,0 +1,12 @@
+"""
+A sqlite backend that can't connect, for benchmarking the retry path without
+a real database outage.
+"""
+from django.db.backends.sqlite3 import base
+
+from typing import Any, Dict  # noqa. flake8 #118
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params: Dict[str, Any]) -> Any:
+        raise base.Database.OperationalError("database is locked")
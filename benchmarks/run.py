@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -* encoding: utf-8 *-
+"""
+Benchmarks for the patched connection path:
+
+* the per-call cost of ``ensure_connection`` on an established connection
+  (the hot path Django runs before every cursor) compared to stock Django
+* the cost of creating a cursor with and without the patch
+* the cost of the connection metrics on a successful connect
+* the latency of a failing ``ensure_connection`` under various retry
+  settings
+* the throughput of many threads hitting a database that can't be reached,
+  with and without the circuit breaker
+* the number of credential lookups during an outage, by a ``pre_reconnect``
+  receiver compared to ``DBCONN_RETRY_CREDENTIAL_PROVIDER``
+
+Everything runs locally against sqlite and a sqlite backend that always
+fails to connect (``benchmarks/failing_backend``). Run it from the
+repository root and optionally store the results as JSON to compare them
+between releases:
+
+    python benchmarks/run.py --json results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    DATABASES={
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            # in-memory databases are never closed by Django, so use a file
+            "NAME": os.path.join(tempfile.mkdtemp(), "bench.sqlite3"),
+        },
+        "failing": {
+            "ENGINE": "failing_backend",
+            "NAME": "unreachable",
+        },
+    },
+    INSTALLED_APPS=[],
+)
+django.setup()
+# every failed connect logs an error
+logging.getLogger("django_dbconn_retry").setLevel(logging.CRITICAL)
+
+from django.db import connection, connections, OperationalError  # noqa: E402
+
+import django_dbconn_retry  # noqa: E402
+from django_dbconn_retry.breaker import reset_breakers  # noqa: E402
+from django_dbconn_retry.credentials import reset_credential_caches  # noqa: E402
+from django_dbconn_retry.policy import clear_policies  # noqa: E402
+
+from typing import Any, Callable, Dict, List  # noqa. flake8 #118
+
+
+RETRY_SETTINGS = [
+    ("no retries", {"MAX_DBCONN_RETRY_TIMES": 0}),
+    ("3 retries, no delay", {"MAX_DBCONN_RETRY_TIMES": 3}),
+    ("3 retries, 1ms exponential", {"MAX_DBCONN_RETRY_TIMES": 3, "DBCONN_RETRY_DELAY": 0.001,
+                                    "DBCONN_RETRY_BACKOFF": 2}),
+    ("3 retries, 1ms full jitter", {"MAX_DBCONN_RETRY_TIMES": 3, "DBCONN_RETRY_DELAY": 0.001,
+                                    "DBCONN_RETRY_BACKOFF": 2, "DBCONN_RETRY_STRATEGY": "full_jitter"}),
+]
+
+THROUGHPUT_SETTINGS = [
+    ("1 retry", {"MAX_DBCONN_RETRY_TIMES": 1}),
+    ("1 retry, circuit breaker", {"MAX_DBCONN_RETRY_TIMES": 1, "DBCONN_RETRY_BREAKER_THRESHOLD": 5,
+                                  "DBCONN_RETRY_BREAKER_COOLDOWN": 60}),
+]
+
+
+def configure(alias: str, overrides: Dict[str, Any]) -> None:
+    settings.DATABASES[alias]["DBCONN_RETRY"] = overrides
+    clear_policies()
+    reset_breakers()
+
+
+def report(label: str, value: float, unit: str) -> float:
+    print("  %-40s %12.1f %s" % (label, value, unit))
+    return value
+
+
+def per_call(func: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e9
+
+
+def create_cursor() -> None:
+    connection.cursor().close()
+
+
+def reconnect() -> None:
+    connection.close()
+    connection.ensure_connection()
+
+
+def fail_to_connect() -> None:
+    dbwrapper = connections["failing"]
+    # the retry counter is only reset by a successful connection, so start every call from scratch
+    dbwrapper._connection_retries = 0
+    try:
+        dbwrapper.ensure_connection()
+    except OperationalError:
+        pass
+
+
+def measure_hot_path(scale: float) -> Dict[str, float]:
+    connection.ensure_connection()
+    return {
+        "ensure_connection_ns": report("ensure_connection", per_call(connection.ensure_connection,
+                                                                     int(200000 * scale)), "ns/call"),
+        "cursor_ns": report("cursor()", per_call(create_cursor, int(50000 * scale)), "ns/call"),
+    }
+
+
+def measure_connect(scale: float) -> Dict[str, float]:
+    results = {}
+    for metrics in (False, True):
+        settings.DBCONN_RETRY_METRICS = metrics
+        clear_policies()
+        label = "with metrics" if metrics else "without metrics"
+        results[label.replace(" ", "_") + "_ns"] = report(label, per_call(reconnect, int(2000 * scale)),
+                                                          "ns/call")
+    del settings.DBCONN_RETRY_METRICS
+    clear_policies()
+    return results
+
+
+def measure_retry_latency(scale: float) -> Dict[str, float]:
+    results = {}
+    for label, overrides in RETRY_SETTINGS:
+        configure("failing", overrides)
+        results[label] = report(label, per_call(fail_to_connect, int(50 * scale)) / 1e3, "us/call")
+    configure("failing", {})
+    return results
+
+
+def measure_throughput(threads: int, duration: float) -> float:
+    calls = [0] * threads
+    stop = threading.Event()
+
+    def worker(index: int) -> None:
+        while not stop.is_set():
+            fail_to_connect()
+            calls[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return sum(calls) / (time.perf_counter() - started)
+
+
+def measure_failing_throughput(scale: float) -> Dict[str, Dict[str, float]]:
+    results = {}  # type: Dict[str, Dict[str, float]]
+    for label, overrides in THROUGHPUT_SETTINGS:
+        results[label] = {}
+        for threads in (1, 8, 32):
+            configure("failing", overrides)
+            results[label]["%d threads" % threads] = report(
+                "%s, %d threads" % (label, threads), measure_throughput(threads, 0.5 * scale), "calls/s",
+            )
+    configure("failing", {})
+    return results
+
+
+def measure_credential_lookups(scale: float) -> Dict[str, int]:
+    lookups = [0]
+    lock = threading.Lock()
+
+    def provider(alias: str) -> Dict[str, Any]:
+        with lock:
+            lookups[0] += 1
+        return {"USER": "app", "PASSWORD": "secret"}
+
+    def receiver(sender: Any, dbwrapper: Any, **kwargs: Any) -> None:
+        # what a pre_reconnect receiver fetching credentials from a secret store does
+        provider(dbwrapper.alias)
+
+    def outage() -> int:
+        lookups[0] = 0
+        workers = [threading.Thread(target=lambda: [fail_to_connect() for _ in range(int(20 * scale) or 1)])
+                   for _ in range(32)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return lookups[0]
+
+    results = {}
+    configure("failing", {"MAX_DBCONN_RETRY_TIMES": 3})
+    django_dbconn_retry.pre_reconnect.connect(receiver)
+    try:
+        results["pre_reconnect receiver"] = int(report("pre_reconnect receiver, 32 threads", outage(), "lookups"))
+    finally:
+        django_dbconn_retry.pre_reconnect.disconnect(receiver)
+    configure("failing", {"MAX_DBCONN_RETRY_TIMES": 3, "DBCONN_RETRY_CREDENTIAL_PROVIDER": provider})
+    reset_credential_caches()
+    results["credential provider"] = int(report("credential provider, 32 threads", outage(), "lookups"))
+    configure("failing", {})
+    return results
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--quick", action="store_true", help="run fewer iterations, less accurately")
+    args = parser.parse_args(argv)
+    scale = 0.1 if args.quick else 1.0
+
+    results = {}  # type: Dict[str, Any]
+    print("stock django")
+    results["stock"] = measure_hot_path(scale)
+    django_dbconn_retry.monkeypatch_django()
+    print("django_dbconn_retry")
+    results["patched"] = measure_hot_path(scale)
+    print("successful connect")
+    results["connect"] = measure_connect(scale)
+    print("failing connect")
+    results["retry_latency_us"] = measure_retry_latency(scale)
+    print("failing connect throughput")
+    results["failing_throughput"] = measure_failing_throughput(scale)
+    print("credential lookups during an outage")
+    results["credential_lookups"] = measure_credential_lookups(scale)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,5 +1,16 @@
 # -* encoding: utf-8 *-
-from django_dbconn_retry.apps import pre_reconnect, post_reconnect, monkeypatch_django, DjangoIntegration
+from django_dbconn_retry.apps import pre_reconnect, post_reconnect, connection_established, monkeypatch_django, \
+    aensure_connection, DjangoIntegration
+from django_dbconn_retry.breaker import CircuitOpenError, breaker_state_changed
+from django_dbconn_retry.deadline import retry_deadline
+from django_dbconn_retry.failover import FailoverRouter, select_alias
+from django_dbconn_retry.limiter import get_connect_limit
+from django_dbconn_retry.metrics import stats
+from django_dbconn_retry.policy import RetryPolicy, get_retry_policy
+from django_dbconn_retry.queries import idempotent, retry_queries
 
 
-__all__ = [pre_reconnect, post_reconnect, monkeypatch_django, DjangoIntegration]
+__all__ = [pre_reconnect, post_reconnect, connection_established, monkeypatch_django, aensure_connection,
+           DjangoIntegration, RetryPolicy, get_retry_policy, CircuitOpenError, breaker_state_changed, stats,
+           idempotent, retry_queries, FailoverRouter, select_alias,
+           get_connect_limit, retry_deadline]
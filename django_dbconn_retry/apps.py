@@ -1,13 +1,31 @@
+import asyncio
 import logging
 import time
 
+from asgiref.sync import sync_to_async
+
 from django.apps.config import AppConfig
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.db.backends.base import base as django_db_base
-from django.db.utils import ProgrammingError
+from django.db.utils import OperationalError, ProgrammingError
 from django.dispatch import Signal
 
-from typing import Union, Tuple, Callable, List  # noqa. flake8 #118
+from django_dbconn_retry.breaker import CircuitBreaker, CircuitOpenError, get_breaker
+from django_dbconn_retry.classify import AUTH, PERMANENT, classify_error
+from django_dbconn_retry.credentials import refresh_credentials
+from django_dbconn_retry.deadline import get_deadline
+from django_dbconn_retry.failover import mark_down, mark_up
+from django_dbconn_retry.limiter import ConnectLimiter, ConnectLimitError, get_limiter
+from django_dbconn_retry.liveness import connection_is_alive
+from django_dbconn_retry.metrics import AliasMetrics, get_metrics
+from django_dbconn_retry.policy import RetryPolicy, build_policies, get_retry_policy
+from django_dbconn_retry.pool import ConnectionPool, attach_pool
+from django_dbconn_retry.retrylog import get_retry_log
+from django_dbconn_retry.singleflight import get_singleflight
+from django_dbconn_retry.state import RetryState, connection_retries, get_state
+
+from typing import Callable, Dict, Optional, Tuple, Type  # noqa. flake8 #118
 
 
 _log = logging.getLogger(__name__)
@@ -15,121 +33,408 @@ _log = logging.getLogger(__name__)
 
 pre_reconnect = Signal()
 post_reconnect = Signal()
+connection_established = Signal()
 
-_operror_types = ()  # type: Union[Tuple[type], Tuple]
-database_modules = [
-    ("django.db.utils", "OperationalError"),
-    ("psycopg2", "OperationalError"),
-    ("psycopg", "OperationalError"),
-    ("sqlite3", "OperationalError"),
-    ("MySQLdb", "OperationalError"),
-    ("pyodbc", "InterfaceError"),
-]
-
-for module_name, error_name in database_modules:
-    try:
-        module = __import__(module_name, fromlist=[error_name])
-        error_type = getattr(module, error_name)
-        _operror_types += (error_type,)
-    except ImportError:
-        pass
+# the exception types worth retrying a connection for, by database backend
+_retryable_errors = {}  # type: Dict[type, Tuple[Type[BaseException], ...]]
 
 
-def monkeypatch_django() -> None:
-    def ensure_connection_with_retries(self: django_db_base.BaseDatabaseWrapper) -> None:
-        self._max_dbconn_retry_times = getattr(settings, "MAX_DBCONN_RETRY_TIMES", 1)
-        # Validate and normalize max retry times to a non-negative integer
-        if not isinstance(self._max_dbconn_retry_times, int) or self._max_dbconn_retry_times < 0:
-            _log.warning(
-                "Invalid MAX_DBCONN_RETRY_TIMES setting %r; falling back to 1.",
-                self._max_dbconn_retry_times,
-            )
-            self._max_dbconn_retry_times = 1
-        self._dbconn_retry_delay = getattr(settings, "DBCONN_RETRY_DELAY", 0)
-        # Validate and normalize retry delay to a non-negative number
-        if not isinstance(self._dbconn_retry_delay, (int, float)) or self._dbconn_retry_delay < 0:
-            _log.warning(
-                "Invalid DBCONN_RETRY_DELAY setting %r; falling back to 0 seconds.",
-                self._dbconn_retry_delay,
-            )
-            self._dbconn_retry_delay = 0
-        self._dbconn_retry_backoff = getattr(settings, "DBCONN_RETRY_BACKOFF", 1)
-        # Validate and normalize backoff factor to a positive number
-        if not isinstance(self._dbconn_retry_backoff, (int, float)) or self._dbconn_retry_backoff <= 0:
-            _log.warning(
-                "Invalid DBCONN_RETRY_BACKOFF setting %r; falling back to 1.",
-                self._dbconn_retry_backoff,
+def get_retryable_errors(dbwrapper: django_db_base.BaseDatabaseWrapper) -> Tuple[Type[BaseException], ...]:
+    """
+    Returns the exception types that make a failed connection attempt through
+    ``dbwrapper`` worth retrying: Django's and the backend driver's
+    ``OperationalError`` (and ``InterfaceError`` for pyodbc, which raises it
+    for failed logins) plus ``DBCONN_RETRY_EXTRA_EXCEPTIONS``. The driver's
+    types are looked up once per backend, so no unused drivers are imported.
+    """
+    cls = type(dbwrapper)
+    errors = _retryable_errors.get(cls)
+    if errors is None:
+        errors = (OperationalError,)
+        database = getattr(dbwrapper, "Database", None)
+        if database is not None:
+            errors += (database.OperationalError,)
+            if database.__name__ == "pyodbc":
+                errors += (database.InterfaceError,)
+        _retryable_errors[cls] = errors
+    return errors + get_retry_policy(dbwrapper.alias).extra_exceptions
+
+
+# Django's own implementation, which makes exactly one connection attempt
+_django_ensure_connection = django_db_base.BaseDatabaseWrapper.ensure_connection
+
+
+class _RetryProgress:
+    """
+    The state of one run of the retry loop.
+    """
+    __slots__ = ("policy", "retries", "started", "deadline", "last_delay", "backoff_time", "elapsed",
+                 "auth_retried")
+
+    def __init__(self, policy: RetryPolicy, retries: int = 0) -> None:
+        self.policy = policy
+        self.retries = retries
+        self.started = time.monotonic()
+        # the earlier of DBCONN_RETRY_DEADLINE and the deadline of the current request
+        self.deadline = get_deadline()
+        if policy.deadline is not None:
+            deadline = self.started + policy.deadline
+            self.deadline = deadline if self.deadline is None else min(self.deadline, deadline)
+        self.last_delay = 0.0
+        self.backoff_time = 0.0
+        self.elapsed = 0.0
+        self.auth_retried = False
+
+    def next_delay(self) -> float:
+        if self.policy.retry_delay > 0:
+            return self.policy.get_delay(self.retries + 1, self.last_delay)
+        return 0.0
+
+    def exceeds_deadline(self, delay: float) -> bool:
+        return self.deadline is not None and time.monotonic() + delay > self.deadline
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def add_backoff(self, delay: float) -> None:
+        self.last_delay = delay
+        self.backoff_time += delay
+
+    def plan(self, error: BaseException) -> Tuple[Optional[str], float]:
+        """
+        Decides how to continue after the failed attempt. Returns the message
+        to give up with (or ``None`` to retry) and the delay before the retry.
+        Rejected credentials are retried once without a delay, so a
+        ``pre_reconnect`` receiver can refresh them.
+        """
+        kind = classify_error(error)
+        if kind == PERMANENT:
+            return "Not reconnecting, the error is permanent %s", 0.0
+        if kind == AUTH:
+            if self.auth_retried:
+                return "Reconnecting with refreshed credentials didn't help %s", 0.0
+            delay = 0.0
+        else:
+            delay = self.next_delay()
+        if self.retries >= self.policy.max_retry_times:
+            return "Reconnecting to the database didn't help %s", delay
+        if self.exceeds_deadline(delay):
+            return "Reconnecting to the database didn't help before the deadline %s", delay
+        if kind == AUTH:
+            self.auth_retried = True
+        return None, delay
+
+    # The steps after a failed attempt, shared by the blocking and the async retry loop. Only waiting for the
+    # delay differs between them.
+
+    def retryable(self, dbwrapper: django_db_base.BaseDatabaseWrapper, error: BaseException) -> bool:
+        """
+        Returns whether the failed attempt may be retried at all. Logs giving
+        up on ``MAX_DBCONN_RETRY_TIMES = 0``.
+        """
+        if not isinstance(error, get_retryable_errors(dbwrapper)):
+            _log.debug("Database connection failed, but not due to a known error for dbconn_retry %s", str(error))
+            return False
+        if self.policy.max_retry_times == 0:
+            get_retry_log(dbwrapper.alias, self.policy.log_interval).gave_up(
+                dbwrapper, "Not reconnecting; MAX_DBCONN_RETRY_TIMES=0. %s", self.retries, error, logging.INFO,
             )
-            self._dbconn_retry_backoff = 1
-
-        if self.connection is not None and hasattr(self.connection, 'closed') and self.connection.closed:
-            _log.debug("failed connection detected")
-            if self.in_atomic_block:
-                self.closed_in_transaction = True
-            self.connection = None
-
-        if self.connection is None and not hasattr(self, '_in_connecting'):
-            if self.in_atomic_block and self.closed_in_transaction:
-                raise ProgrammingError("Cannot reconnect to the database in an atomic block.")
-            with self.wrap_database_errors:
+            mark_down(dbwrapper.alias, self.policy.breaker_cooldown)
+            return False
+        return True
+
+    def schedule_retry(self, dbwrapper: django_db_base.BaseDatabaseWrapper, error: BaseException) -> Optional[float]:
+        """
+        Counts the retry after the failed attempt and returns the delay before
+        it. Returns ``None`` after logging that it gave up, marking the alias
+        as down and, if it retried before, sending ``post_reconnect``.
+        """
+        retry_log = get_retry_log(dbwrapper.alias, self.policy.log_interval)
+        give_up, delay = self.plan(error)
+        if give_up is not None:
+            retry_log.gave_up(dbwrapper, give_up, self.retries, error)
+            mark_down(dbwrapper.alias, self.policy.breaker_cooldown)
+            if self.retries > 0:
+                # answer the last pre_reconnect. Giving up on the first attempt, e.g. on a permanent error, sent none.
+                post_reconnect.send(dbwrapper.__class__, dbwrapper=dbwrapper, attempt=self.retries,
+                                    elapsed=self.elapsed, backoff_time=self.backoff_time, exception=error)
+            return None
+        self.retries += 1
+        retry_log.retrying(dbwrapper, self.retries, delay, error)
+        if self.policy.metrics:
+            get_metrics(dbwrapper.alias).record_retry(delay)
+        return delay
+
+    def refresh_credentials(self, dbwrapper: django_db_base.BaseDatabaseWrapper, error: BaseException,
+                            attempt_started: float) -> None:
+        if self.policy.credential_provider is None:
+            return
+        # credentials the database rejected must be fetched again, even if they haven't expired yet
+        since = attempt_started if classify_error(error) == AUTH else None
+        refresh_credentials(dbwrapper, self.policy.credential_provider, self.policy.credential_ttl, since)
+
+    def connected(self, alias: str) -> None:
+        mark_up(alias)
+        # report the rest of the outage now instead of with the next failure, which might be days away
+        get_retry_log(alias, self.policy.log_interval).flush()
+
+    def reconnecting(self, dbwrapper: django_db_base.BaseDatabaseWrapper, error: BaseException) -> None:
+        # give libraries like 12factor-vault the chance to update the credentials
+        pre_reconnect.send(dbwrapper.__class__, dbwrapper=dbwrapper, attempt=self.retries,
+                           backoff_time=self.backoff_time, exception=error)
+
+
+def _discard_failed_connection(dbwrapper: django_db_base.BaseDatabaseWrapper) -> None:
+    if dbwrapper.connection is None:
+        return
+    if hasattr(dbwrapper.connection, 'closed') and dbwrapper.connection.closed:
+        _log.debug("failed connection detected")
+        if dbwrapper.in_atomic_block:
+            dbwrapper.closed_in_transaction = True
+        dbwrapper.connection = None
+    elif not dbwrapper.in_atomic_block and dbwrapper.autocommit:
+        # Outside of transactions a stale connection can be replaced transparently
+        interval = get_retry_policy(dbwrapper.alias).liveness_interval
+        if interval is None:
+            return
+        now = time.monotonic()
+        state = get_state(dbwrapper)
+        if now - state.liveness_checked < interval:
+            return
+        state.liveness_checked = now
+        if not connection_is_alive(dbwrapper.connection, dbwrapper.vendor):
+            _log.info("stale connection to database %s detected, reconnecting", dbwrapper.alias)
+            try:
+                dbwrapper.connection.close()
+            except Exception:
+                pass
+            dbwrapper.connection = None
+
+
+def _connect(dbwrapper: django_db_base.BaseDatabaseWrapper, connect: Callable[[], None],
+             limiter: ConnectLimiter, progress: _RetryProgress) -> None:
+    """
+    Makes one connection attempt through ``connect`` once ``limiter`` allows it.
+    """
+    token = limiter.acquire(progress.remaining())
+    if token is None:
+        raise ConnectLimitError("Too many concurrent connection attempts to database %s." % dbwrapper.alias)
+    try:
+        connect()
+    except BaseException as e:
+        limiter.release(token, e)
+        raise
+    limiter.release(token)
+
+
+def _record_attempt(dbwrapper: django_db_base.BaseDatabaseWrapper, elapsed: float, error: Optional[BaseException],
+                    breaker: Optional[CircuitBreaker], pool: Optional[ConnectionPool],
+                    metrics: Optional[AliasMetrics]) -> None:
+    if metrics is not None:
+        metrics.record_attempt(elapsed, error)
+    if error is None:
+        if breaker is not None:
+            breaker.record_success()
+    elif isinstance(error, get_retryable_errors(dbwrapper)):
+        if breaker is not None:
+            breaker.record_failure()
+        if pool is not None:
+            # the idle connections most likely broke as well
+            pool.clear()
+
+
+def _connect_once(using: str, progress: _RetryProgress) -> bool:
+    """
+    Makes a single connection attempt for ``using`` unless it's already
+    connected. Returns whether a new connection was established.
+    """
+    dbwrapper = connections[using]
+    _discard_failed_connection(dbwrapper)
+    if dbwrapper.connection is not None:
+        return False
+    if dbwrapper.in_atomic_block and dbwrapper.closed_in_transaction:
+        raise ProgrammingError("Cannot reconnect to the database in an atomic block.")
+    policy = get_retry_policy(using)
+    breaker = get_breaker(using, policy.breaker_threshold, policy.breaker_cooldown, policy.breaker_shared_dir)
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpenError("Circuit breaker for database %s is open." % using)
+    metrics = get_metrics(using) if policy.metrics else None
+    pool = attach_pool(dbwrapper, policy.pool_size)
+    limiter = get_limiter(using, policy.connect_concurrency)
+    connect_started = time.perf_counter()
+    try:
+        _connect(dbwrapper, lambda: _django_ensure_connection(dbwrapper), limiter, progress)
+    except ConnectLimitError:
+        raise
+    except Exception as e:
+        _record_attempt(dbwrapper, time.perf_counter() - connect_started, e, breaker, pool, metrics)
+        raise
+    _record_attempt(dbwrapper, time.perf_counter() - connect_started, None, breaker, pool, metrics)
+    return True
+
+
+async def aensure_connection(using: str = DEFAULT_DB_ALIAS) -> None:
+    """
+    The asynchronous counterpart of the patched ``ensure_connection``. Each
+    connection attempt runs in Django's thread-sensitive executor, but the
+    backoff between attempts is awaited with ``asyncio.sleep()``, so the
+    executor (and with it every other request's ORM access) isn't blocked
+    while waiting for the database to come back.
+
+    Await this in async views or middleware before using the async ORM. The
+    async ORM's own implicit connects still go through the blocking
+    ``ensure_connection`` and wait with ``time.sleep()`` in the executor.
+    """
+    policy = get_retry_policy(using)
+    connect = sync_to_async(_connect_once, thread_sensitive=True)
+    # connections are thread-local, so use the wrapper that connect() connects in the thread-sensitive executor
+    dbwrapper = await sync_to_async(connections.__getitem__, thread_sensitive=True)(using)
+    progress = _RetryProgress(policy)
+    while True:
+        # this includes handing the attempt to the executor, which is close enough
+        connect_started = time.perf_counter()
+        try:
+            connected = await connect(using, progress)
+        except (CircuitOpenError, ConnectLimitError):
+            raise
+        except Exception as e:
+            progress.elapsed = time.perf_counter() - connect_started
+            if not progress.retryable(dbwrapper, e):
+                raise
+            delay = await sync_to_async(progress.schedule_retry)(dbwrapper, e)
+            if delay is None:
+                raise
+            if delay > 0:
+                await asyncio.sleep(delay)
+                progress.add_backoff(delay)
+            await sync_to_async(progress.refresh_credentials, thread_sensitive=False)(dbwrapper, e, connect_started)
+            await sync_to_async(progress.reconnecting)(dbwrapper, e)
+        else:
+            if not connected:
+                return
+            progress.elapsed = time.perf_counter() - connect_started
+            progress.connected(using)
+            if connection_established.has_listeners(dbwrapper.__class__):
+                await sync_to_async(connection_established.send)(
+                    dbwrapper.__class__, dbwrapper=dbwrapper, attempt=progress.retries, elapsed=progress.elapsed,
+                    backoff_time=progress.backoff_time,
+                )
+            if progress.retries > 0:
+                await sync_to_async(post_reconnect.send)(
+                    dbwrapper.__class__, dbwrapper=dbwrapper, attempt=progress.retries, elapsed=progress.elapsed,
+                    backoff_time=progress.backoff_time, exception=None,
+                )
+            return
+
+
+def ensure_connection_with_retries(self: django_db_base.BaseDatabaseWrapper) -> None:
+    _discard_failed_connection(self)
+    if self.connection is not None:
+        return
+    state = get_state(self)
+    with state.lock:
+        # connecting runs queries, which end up here again. And a thread sharing this connection might have
+        # connected while we waited for the lock.
+        if self.connection is not None or state.connecting:
+            return
+        if self.in_atomic_block and self.closed_in_transaction:
+            raise ProgrammingError("Cannot reconnect to the database in an atomic block.")
+        _connect_with_retries(self, state)
+
+
+def _connect_with_retries(self: django_db_base.BaseDatabaseWrapper, state: RetryState) -> None:
+    policy = get_retry_policy(self.alias)
+    breaker = get_breaker(self.alias, policy.breaker_threshold, policy.breaker_cooldown, policy.breaker_shared_dir)
+    metrics = get_metrics(self.alias) if policy.metrics else None
+    pool = attach_pool(self, policy.pool_size)
+    limiter = get_limiter(self.alias, policy.connect_concurrency)
+    retry_log = get_retry_log(self.alias, policy.log_interval)
+    progress = _RetryProgress(policy, state.retries)
+    first_retry = progress.retries + 1
+    singleflight = get_singleflight(self.alias) if policy.singleflight_timeout is not None else None
+    # set once this thread failed to connect and joined the reconnect of the alias
+    flight = None
+    leading = connected = False
+
+    try:
+        with self.wrap_database_errors:
+            while True:
+                if breaker is not None and not breaker.allow():
+                    raise CircuitOpenError("Circuit breaker for database %s is open." % self.alias)
+                connect_started = time.perf_counter()
                 try:
-                    self._in_connecting = True
-                    self.connect()
+                    state.connecting = True
+                    try:
+                        _connect(self, self.connect, limiter, progress)
+                    finally:
+                        state.connecting = False
+                except ConnectLimitError:
+                    raise
                 except Exception as e:
-                    if isinstance(e, _operror_types):
-                        if self._max_dbconn_retry_times == 0:
-                            _log.info("Not reconnecting; MAX_DBCONN_RETRY_TIMES=0.")
-                            del self._in_connecting
-                            raise
-                        elif (
-                                hasattr(self, "_connection_retries") and
-                                self._connection_retries >= self._max_dbconn_retry_times
-                        ):
-                            _log.error("Reconnecting to the database didn't help %s", str(e))
-                            del self._in_connecting
-                            post_reconnect.send(self.__class__, dbwrapper=self)
-                            raise
-                        else:
-                            _log.info("Database connection failed. Refreshing...")
-                            # mark the retry
-                            try:
-                                self._connection_retries += 1
-                            except AttributeError:
-                                self._connection_retries = 1
-
-                            # ensure that we retry the connection. Sometimes .closed isn't set correctly.
-                            self.connection = None
-                            del self._in_connecting
-
-                            # apply delay with backoff before retry
-                            if self._dbconn_retry_delay > 0:
-                                current_delay = self._dbconn_retry_delay * (
-                                    self._dbconn_retry_backoff ** (self._connection_retries - 1)
-                                )
-                                _log.debug("Waiting %.2f seconds before retry attempt %d",
-                                           current_delay, self._connection_retries)
-                                time.sleep(current_delay)
-
-                            # give libraries like 12factor-vault the chance to update the credentials
-                            pre_reconnect.send(self.__class__, dbwrapper=self)
-                            self.ensure_connection()
-                            post_reconnect.send(self.__class__, dbwrapper=self)
-                    else:
-                        _log.debug("Database connection failed, but not due to a known error for dbconn_retry %s",
-                                   str(e))
-                        del self._in_connecting
+                    progress.elapsed = time.perf_counter() - connect_started
+                    _record_attempt(self, progress.elapsed, e, breaker, pool, metrics)
+                    if not progress.retryable(self, e):
                         raise
+                    if singleflight is not None and flight is None:
+                        flight, leading = singleflight.join()
+                        if not leading:
+                            timeout = policy.singleflight_timeout
+                            remaining = progress.remaining()
+                            if remaining is not None and (timeout is None or remaining < timeout):
+                                timeout = remaining
+                            _log.debug("Waiting for another thread to reconnect to database %s", self.alias)
+                            if not flight.wait(timeout):
+                                retry_log.gave_up(self, "Reconnecting to the database in another thread didn't help %s",
+                                                  progress.retries, e)
+                                raise
+                            # the database is reachable again, open our own connection
+                            continue
+                    delay = progress.schedule_retry(self, e)
+                    if delay is None:
+                        raise
+                    state.retries = progress.retries
+
+                    # ensure that we retry the connection. Sometimes .closed isn't set correctly.
+                    self.connection = None
+
+                    # apply delay with backoff before retry
+                    if delay > 0:
+                        time.sleep(delay)
+                        progress.add_backoff(delay)
+                    progress.refresh_credentials(self, e, connect_started)
+                    progress.reconnecting(self, e)
                 else:
-                    # connection successful, reset the flag
-                    self._connection_retries = 0
-                    del self._in_connecting
+                    progress.elapsed = time.perf_counter() - connect_started
+                    _record_attempt(self, progress.elapsed, None, breaker, pool, metrics)
+                    progress.connected(self.alias)
+                    connected = True
+                    # connection successful, reset the counter before receivers get the chance to raise
+                    state.retries = 0
+                    if connection_established.has_listeners(self.__class__):
+                        connection_established.send(self.__class__, dbwrapper=self, attempt=progress.retries,
+                                                    elapsed=progress.elapsed, backoff_time=progress.backoff_time)
+                    # every pre_reconnect is answered by a post_reconnect, latest retry first
+                    for attempt in range(progress.retries, first_retry - 1, -1):
+                        post_reconnect.send(self.__class__, dbwrapper=self, attempt=attempt, elapsed=progress.elapsed,
+                                            backoff_time=progress.backoff_time, exception=None)
+                    return
+    finally:
+        if leading and singleflight is not None and flight is not None:
+            singleflight.land(flight, connected)
 
+
+def monkeypatch_django() -> None:
     _log.debug("django_dbconn_retry: monkeypatching BaseDatabaseWrapper")
     django_db_base.BaseDatabaseWrapper.ensure_connection = ensure_connection_with_retries
+    django_db_base.BaseDatabaseWrapper._connection_retries = connection_retries  # type: ignore[attr-defined]
 
 
 class DjangoIntegration(AppConfig):
     name = "django_dbconn_retry"
 
     def ready(self) -> None:
-        monkeypatch_django()
+        build_policies()
+        if getattr(settings, "DBCONN_RETRY_MONKEYPATCH", True):
+            monkeypatch_django()
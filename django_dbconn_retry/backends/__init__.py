@@ -0,0 +1,48 @@
+"""
+Database engines that wrap another engine. The wrapped engine is configured
+with ``WRAPPED_ENGINE`` in the database's entry in ``DATABASES``, e.g.::
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "django_dbconn_retry.backends.faultinjection",
+            "WRAPPED_ENGINE": "django.db.backends.postgresql",
+            # ...
+        },
+    }
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.utils import load_backend
+
+from typing import Any, Dict, Tuple, Type  # noqa. flake8 #118
+
+
+_wrapper_classes = {}  # type: Dict[Tuple[Tuple[type, ...], str], Type[BaseDatabaseWrapper]]
+_wrapper_classes_lock = threading.Lock()
+
+
+def wrap_engine(settings_dict: Dict[str, Any], *mixins: type) -> Type[BaseDatabaseWrapper]:
+    """
+    Returns a subclass of the ``DatabaseWrapper`` of ``WRAPPED_ENGINE`` in
+    ``settings_dict`` with ``mixins`` as its first base classes. The classes
+    are created once per combination of mixins and engine.
+    """
+    engine = settings_dict.get("WRAPPED_ENGINE")
+    if not engine:
+        raise ImproperlyConfigured("The database engine %s requires WRAPPED_ENGINE to be set." %
+                                   settings_dict.get("ENGINE"))
+    key = (mixins, engine)
+    try:
+        return _wrapper_classes[key]
+    except KeyError:
+        pass
+    wrapped = load_backend(engine).DatabaseWrapper
+    if not isinstance(wrapped, type) or not issubclass(wrapped, BaseDatabaseWrapper):
+        raise ImproperlyConfigured("WRAPPED_ENGINE %s can't be wrapped by %s, it must be a regular database engine." %
+                                   (engine, settings_dict.get("ENGINE")))
+    with _wrapper_classes_lock:
+        return _wrapper_classes.setdefault(key, type("DatabaseWrapper", mixins + (wrapped,), {
+            "__module__": mixins[0].__module__,
+        }))
@@ -0,0 +1,124 @@
+"""
+A database engine that wraps another one and makes connecting to it fail or
+slow down on purpose, for trying out retry settings without an actual
+outage. Configure the faults with a ``FAULT_INJECTION`` block::
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "django_dbconn_retry.backends.faultinjection",
+            "WRAPPED_ENGINE": "django.db.backends.sqlite3",
+            "NAME": "db.sqlite3",
+            "FAULT_INJECTION": {
+                # the share of connection attempts that fail
+                "FAILURE_RATE": 0.1,
+                # seconds added to every connection attempt
+                "LATENCY": 0.05,
+                # (start, duration) in seconds after the first connection
+                # attempt during which the database can't be reached
+                "OUTAGES": [(10, 5)],
+            },
+        },
+    }
+"""
+import logging
+import random
+import threading
+import time
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from django_dbconn_retry.backends import wrap_engine
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+class Faults:
+    """
+    The faults injected into connection attempts to one database alias,
+    shared by all threads of a process. Outages are given relative to
+    ``epoch``, which is set when the faults are created.
+    """
+
+    def __init__(self, failure_rate: float = 0.0, latency: float = 0.0,
+                 outages: Iterable[Tuple[float, float]] = ()) -> None:
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.epoch = time.monotonic()
+        self.outages = [(self.epoch + start, self.epoch + start + duration)
+                        for start, duration in outages]  # type: List[Tuple[float, float]]
+
+    @classmethod
+    def from_settings(cls, settings_dict: Dict[str, Any]) -> "Faults":
+        config = settings_dict.get("FAULT_INJECTION", {})
+        return cls(config.get("FAILURE_RATE", 0.0), config.get("LATENCY", 0.0), config.get("OUTAGES", ()))
+
+    def start_outage(self, duration: float) -> None:
+        now = time.monotonic()
+        self.outages.append((now, now + duration))
+
+    def in_outage(self, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        return any(start <= now < end for start, end in self.outages)
+
+    def inject(self, error: type) -> None:
+        """
+        Delays the connection attempt by ``latency`` and raises ``error`` if
+        the database is down or the attempt was picked to fail.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.in_outage():
+            raise error("fault injection: the database is unreachable")
+        if self.failure_rate > 0 and random.random() < self.failure_rate:
+            raise error("fault injection: the connection attempt failed")
+
+
+_faults = {}  # type: Dict[str, Faults]
+_faults_lock = threading.Lock()
+
+
+def get_faults(alias: str, settings_dict: Optional[Dict[str, Any]] = None) -> Faults:
+    """
+    Returns the faults for ``alias``, creating them from the
+    ``FAULT_INJECTION`` block in ``settings_dict`` the first time.
+    """
+    faults = _faults.get(alias)
+    if faults is None:
+        with _faults_lock:
+            faults = _faults.setdefault(alias, Faults.from_settings(settings_dict or {}))
+    return faults
+
+
+def set_faults(alias: str, faults: Faults) -> None:
+    with _faults_lock:
+        _faults[alias] = faults
+
+
+def reset_faults() -> None:
+    with _faults_lock:
+        _faults.clear()
+
+
+class FaultInjectionMixin:
+    # provided by the wrapped engine's DatabaseWrapper. Only annotated, so they don't shadow it.
+    alias: str
+    settings_dict: Dict[str, Any]
+    Database: Any
+
+    # overrides the faults of the alias for this connection only
+    faults = None  # type: Optional[Faults]
+
+    def get_new_connection(self, conn_params: Dict[str, Any]) -> Any:
+        faults = self.faults or get_faults(self.alias, self.settings_dict)
+        faults.inject(self.Database.OperationalError)
+        return super().get_new_connection(conn_params)  # type: ignore
+
+
+def DatabaseWrapper(settings_dict: Dict[str, Any], alias: str = DEFAULT_DB_ALIAS) -> BaseDatabaseWrapper:
+    # Django instantiates the engine's DatabaseWrapper, which has to be a subclass of the wrapped engine's
+    return wrap_engine(settings_dict, FaultInjectionMixin)(settings_dict, alias)
@@ -0,0 +1,32 @@
+"""
+A database engine that wraps another one and retries connecting to it,
+without monkeypatching Django. Only databases using this engine retry::
+
+    DBCONN_RETRY_MONKEYPATCH = False
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "django_dbconn_retry.backends.wrap",
+            "WRAPPED_ENGINE": "django.db.backends.postgresql",
+            # ...
+        },
+    }
+"""
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from django_dbconn_retry.apps import ensure_connection_with_retries
+from django_dbconn_retry.backends import wrap_engine
+from django_dbconn_retry.state import connection_retries
+
+from typing import Any, Dict  # noqa. flake8 #118
+
+
+class RetryMixin:
+    ensure_connection = ensure_connection_with_retries
+    _connection_retries = connection_retries
+
+
+def DatabaseWrapper(settings_dict: Dict[str, Any], alias: str = DEFAULT_DB_ALIAS) -> BaseDatabaseWrapper:
+    # Django instantiates the engine's DatabaseWrapper, which has to be a subclass of the wrapped engine's
+    return wrap_engine(settings_dict, RetryMixin)(settings_dict, alias)
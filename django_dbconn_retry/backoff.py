@@ -0,0 +1,51 @@
+import random
+
+from django.utils.module_loading import import_string
+
+from typing import Callable, Dict, Union  # noqa. flake8 #118
+
+
+# A backoff strategy is called with the number of the retry attempt (starting
+# at 1), DBCONN_RETRY_DELAY, DBCONN_RETRY_BACKOFF and the delay that was used
+# before the previous attempt (0 for the first retry). It returns the number
+# of seconds to wait before the next attempt.
+BackoffStrategy = Callable[[int, float, float, float], float]
+
+
+def exponential(attempt: int, delay: float, backoff: float, previous: float) -> float:
+    return delay * (backoff ** (attempt - 1))
+
+
+def full_jitter(attempt: int, delay: float, backoff: float, previous: float) -> float:
+    return random.uniform(0, exponential(attempt, delay, backoff, previous))
+
+
+def equal_jitter(attempt: int, delay: float, backoff: float, previous: float) -> float:
+    half = exponential(attempt, delay, backoff, previous) / 2
+    return half + random.uniform(0, half)
+
+
+def decorrelated_jitter(attempt: int, delay: float, backoff: float, previous: float) -> float:
+    return random.uniform(delay, max(delay, previous or delay) * 3)
+
+
+STRATEGIES = {
+    "exponential": exponential,
+    "full_jitter": full_jitter,
+    "equal_jitter": equal_jitter,
+    "decorrelated_jitter": decorrelated_jitter,
+}  # type: Dict[str, BackoffStrategy]
+
+
+def resolve_strategy(strategy: Union[str, BackoffStrategy]) -> BackoffStrategy:
+    """
+    Resolves ``DBCONN_RETRY_STRATEGY``, which is either the name of one of the
+    built-in strategies, the dotted path to a callable or the callable itself.
+
+    :raises ImportError: if the strategy can't be found
+    """
+    if callable(strategy):
+        return strategy
+    if strategy in STRATEGIES:
+        return STRATEGIES[strategy]
+    return import_string(strategy)
@@ -0,0 +1,217 @@
+import contextlib
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from django.db.utils import OperationalError
+from django.dispatch import Signal
+
+from typing import Dict, Iterator, List, Optional, Tuple, Union  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+breaker_state_changed = Signal()
+
+
+class CircuitOpenError(OperationalError):
+    """
+    Raised instead of connecting while the circuit breaker for a database alias
+    is open.
+    """
+    pass
+
+
+class LocalBreakerState:
+    """
+    Circuit breaker state that is shared by the threads of one process.
+    """
+
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.changed_at = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator["LocalBreakerState"]:
+        with self._lock:
+            yield self
+
+
+class SharedBreakerState:
+    """
+    Circuit breaker state that lives in a small mmap'd file, so it's shared by
+    all processes on a host that use the same file, e.g. all workers of a
+    gunicorn server. Access is serialized with ``flock()``.
+
+    ``time.monotonic()`` is system-wide on the platforms we support, so
+    timestamps are comparable between processes.
+    """
+    _format = struct.Struct("<BId")
+    _states = (CLOSED, OPEN, HALF_OPEN)
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.state = CLOSED
+        self.failures = 0
+        self.changed_at = 0.0
+        self._pid = 0
+        self._open()
+
+    def _open(self) -> None:
+        # file locks belong to the open file description, which is shared with forked children. So every
+        # process needs its own.
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self._format.size:
+                os.ftruncate(self._fd, self._format.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self._format.size)
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator["SharedBreakerState"]:
+        if self._pid != os.getpid():
+            self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                state, self.failures, self.changed_at = self._format.unpack_from(self._map)
+                self.state = self._states[state]
+                yield self
+                self._format.pack_into(self._map, 0, self._states.index(self.state), self.failures, self.changed_at)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+BreakerState = Union[LocalBreakerState, SharedBreakerState]
+
+
+class CircuitBreaker:
+    """
+    A per-alias circuit breaker.
+
+    After ``threshold`` consecutive failed connection attempts the breaker
+    opens and ``allow()`` refuses all attempts for ``cooldown`` seconds. After
+    that a single caller is allowed to probe the database (half-open). If the
+    probe succeeds the breaker closes again, otherwise it reopens. A probe that
+    doesn't report back within ``cooldown`` seconds is replaced by a new one.
+
+    The state is kept in ``store``, which is either local to the process or
+    shared between processes.
+    """
+
+    def __init__(self, alias: str, threshold: int, cooldown: float, store: Optional[BreakerState] = None) -> None:
+        self.alias = alias
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.store = store if store is not None else LocalBreakerState()  # type: BreakerState
+
+    @property
+    def state(self) -> str:
+        with self.store.locked() as st:
+            return st.state
+
+    def is_open(self) -> bool:
+        """
+        Returns whether ``allow()`` would currently refuse connection attempts,
+        without becoming the probe.
+        """
+        with self.store.locked() as st:
+            return st.state != CLOSED and time.monotonic() - st.changed_at < self.cooldown
+
+    def allow(self) -> bool:
+        transition = None  # type: Optional[Tuple[str, str]]
+        with self.store.locked() as st:
+            if st.state == CLOSED:
+                return True
+            if time.monotonic() - st.changed_at < self.cooldown:
+                return False
+            # this caller becomes the probe
+            transition = self._set_state(st, HALF_OPEN)
+        self._send(transition)
+        return True
+
+    def record_success(self) -> None:
+        transition = None  # type: Optional[Tuple[str, str]]
+        with self.store.locked() as st:
+            st.failures = 0
+            if st.state != CLOSED:
+                transition = self._set_state(st, CLOSED)
+        self._send(transition)
+
+    def record_failure(self) -> None:
+        transition = None  # type: Optional[Tuple[str, str]]
+        with self.store.locked() as st:
+            st.failures += 1
+            if st.state == HALF_OPEN or (st.state == CLOSED and st.failures >= self.threshold):
+                transition = self._set_state(st, OPEN)
+        self._send(transition)
+
+    def _set_state(self, st: BreakerState, state: str) -> Tuple[str, str]:
+        old_state, st.state = st.state, state
+        st.changed_at = time.monotonic()
+        return old_state, state
+
+    def _send(self, transition: Optional[Tuple[str, str]]) -> None:
+        # signals are sent outside of the lock so receivers can't deadlock the breaker
+        if transition is not None and transition[0] != transition[1]:
+            old_state, new_state = transition
+            _log.warning("Circuit breaker for database %s changed from %s to %s", self.alias, old_state, new_state)
+            breaker_state_changed.send(self.__class__, alias=self.alias, old_state=old_state, new_state=new_state)
+
+
+_breakers = {}  # type: Dict[str, CircuitBreaker]
+_breakers_lock = threading.Lock()
+
+
+def _shared_state_path(shared_dir: str, alias: str) -> str:
+    return os.path.join(shared_dir, "%s.breaker" % re.sub(r"[^A-Za-z0-9_.-]", "_", alias))
+
+
+def get_breaker(alias: str, threshold: int, cooldown: float,
+                shared_dir: Optional[str] = None) -> Optional[CircuitBreaker]:
+    """
+    Returns the process-wide circuit breaker for ``alias`` or ``None`` if
+    ``threshold`` is 0 and the breaker is disabled. If ``shared_dir`` is set,
+    the breaker's state is shared with all processes using the same directory.
+    """
+    if threshold == 0:
+        return None
+    breaker = _breakers.get(alias)
+    path = _shared_state_path(shared_dir, alias) if shared_dir else None
+    if breaker is None or getattr(breaker.store, "path", None) != path:
+        with _breakers_lock:
+            if breaker is not None and isinstance(breaker.store, SharedBreakerState):
+                breaker.store.close()
+            store = SharedBreakerState(path) if path else LocalBreakerState()  # type: BreakerState
+            breaker = _breakers[alias] = CircuitBreaker(alias, threshold, cooldown, store)
+    breaker.threshold = threshold
+    breaker.cooldown = cooldown
+    return breaker
+
+
+def reset_breakers() -> None:
+    with _breakers_lock:
+        for breaker in _breakers.values():
+            if isinstance(breaker.store, SharedBreakerState):
+                breaker.store.close()
+        _breakers.clear()
@@ -0,0 +1,106 @@
+import re
+
+from typing import List, Optional, Pattern, Tuple  # noqa. flake8 #118
+
+
+# the error is likely to go away by itself, e.g. a refused connection or a server restart
+TRANSIENT = "transient"
+# retrying won't help, e.g. the database doesn't exist
+PERMANENT = "permanent"
+# the credentials were rejected, which a pre_reconnect receiver might be able to fix
+AUTH = "auth"
+
+# PostgreSQL SQLSTATEs as exposed by psycopg (``sqlstate``) and psycopg2 (``pgcode``)
+_SQLSTATES = {
+    "3D000": PERMANENT,  # invalid_catalog_name, the database doesn't exist
+    "42501": PERMANENT,  # insufficient_privilege, e.g. no CONNECT privilege
+    "53300": TRANSIENT,  # too_many_connections
+    "57P01": TRANSIENT,  # admin_shutdown
+    "57P02": TRANSIENT,  # crash_shutdown
+    "57P03": TRANSIENT,  # cannot_connect_now, the server is starting up
+}
+
+_SQLSTATE_CLASSES = {
+    "08": TRANSIENT,  # connection exception
+    "28": AUTH,  # invalid authorization specification
+}
+
+# MySQL client and server error numbers
+_MYSQL_ERRNOS = {
+    1040: TRANSIENT,  # ER_CON_COUNT_ERROR, too many connections
+    1044: PERMANENT,  # ER_DBACCESS_DENIED_ERROR
+    1045: AUTH,  # ER_ACCESS_DENIED_ERROR
+    1049: PERMANENT,  # ER_BAD_DB_ERROR
+    1129: PERMANENT,  # ER_HOST_IS_BLOCKED
+    1203: TRANSIENT,  # ER_TOO_MANY_USER_CONNECTIONS
+    2002: TRANSIENT,  # CR_CONNECTION_ERROR
+    2003: TRANSIENT,  # CR_CONN_HOST_ERROR
+    2006: TRANSIENT,  # CR_SERVER_GONE_ERROR
+    2013: TRANSIENT,  # CR_SERVER_LOST
+}
+
+# for drivers (and libpq connection errors) that only have a message
+_MESSAGES = [
+    (re.compile(r"password authentication failed|access denied for user|login failed for user|"
+                r"role \".*\" does not exist"), AUTH),
+    (re.compile(r"database \".*\" does not exist|unknown database|unable to open database file"), PERMANENT),
+    (re.compile(r"database is locked|too many (connections|clients)|remaining connection slots are reserved"),
+     TRANSIENT),
+]  # type: List[Tuple[Pattern[str], str]]
+
+
+def _classify(error: BaseException) -> Optional[str]:
+    code = getattr(error, "sqlstate", None) or getattr(error, "pgcode", None)
+    if isinstance(code, str) and code:
+        kind = _SQLSTATES.get(code) or _SQLSTATE_CLASSES.get(code[:2])
+        if kind is not None:
+            return kind
+    if error.args and isinstance(error.args[0], int) and error.args[0] in _MYSQL_ERRNOS:
+        return _MYSQL_ERRNOS[error.args[0]]
+    message = str(error).lower()
+    for pattern, kind in _MESSAGES:
+        if pattern.search(message):
+            return kind
+    return None
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Classifies a failed connection attempt as ``TRANSIENT``, ``PERMANENT`` or
+    ``AUTH`` by the driver's error code (psycopg's SQLSTATE, MySQL's errno) or
+    message (sqlite). Errors that Django wrapped are classified by the
+    driver's original error. Unknown errors are considered transient.
+    """
+    current = error  # type: Optional[BaseException]
+    while current is not None:
+        kind = _classify(current)
+        if kind is not None:
+            return kind
+        current = current.__cause__
+    return TRANSIENT
+
+
+_OVERLOAD_SQLSTATES = ("53300",)  # too_many_connections
+_OVERLOAD_ERRNOS = (1040, 1203)  # ER_CON_COUNT_ERROR, ER_TOO_MANY_USER_CONNECTIONS
+# PostgreSQL reports max_connections to roles without SUPERUSER as "remaining connection slots are reserved for
+# non-replication superuser connections" before 16 and "... reserved for roles with the SUPERUSER attribute" (or
+# "... with privileges of the pg_use_reserved_connections role") since, without a SQLSTATE on connect errors
+_OVERLOAD_MESSAGE = re.compile(r"too many (connections|clients)|remaining connection slots are reserved")
+
+
+def is_overload(error: BaseException) -> bool:
+    """
+    Returns whether the database refused the connection because it has too
+    many connections already.
+    """
+    current = error  # type: Optional[BaseException]
+    while current is not None:
+        code = getattr(current, "sqlstate", None) or getattr(current, "pgcode", None)
+        if code in _OVERLOAD_SQLSTATES:
+            return True
+        if current.args and current.args[0] in _OVERLOAD_ERRNOS:
+            return True
+        if _OVERLOAD_MESSAGE.search(str(current).lower()):
+            return True
+        current = current.__cause__
+    return False
@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+CredentialProvider = Callable[[str], Mapping[str, Any]]
+
+
+class CredentialCache:
+    """
+    Caches the credentials returned by a ``DBCONN_RETRY_CREDENTIAL_PROVIDER``
+    for one database alias for ``ttl`` seconds, shared by all threads of a
+    process. Only one thread calls the provider at a time, the others wait
+    for its result instead of asking the provider themselves.
+    """
+
+    def __init__(self, alias: str, provider: CredentialProvider, ttl: float) -> None:
+        self.alias = alias
+        self.provider = provider
+        self.ttl = ttl
+        self.fetches = 0
+        # the credentials and the time.perf_counter() they were fetched at
+        self._entry = None  # type: Optional[Tuple[Dict[str, Any], float]]
+        self._fetch_lock = threading.Lock()
+
+    def _fresh(self, since: Optional[float]) -> Optional[Dict[str, Any]]:
+        entry = self._entry
+        if entry is None:
+            return None
+        credentials, fetched = entry
+        if time.perf_counter() - fetched >= self.ttl or (since is not None and fetched < since):
+            return None
+        return credentials
+
+    def get(self, since: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached credentials or fetches them if they expired or were
+        fetched before ``since``, e.g. because the database just rejected
+        them. Returns ``None`` if the provider failed.
+        """
+        credentials = self._fresh(since)
+        if credentials is not None:
+            return credentials
+        with self._fetch_lock:
+            # another thread might have fetched them while we waited
+            credentials = self._fresh(since)
+            if credentials is not None:
+                return credentials
+            self.fetches += 1
+            try:
+                credentials = dict(self.provider(self.alias))
+            except Exception:
+                _log.warning("Fetching the credentials for database %s failed", self.alias, exc_info=True)
+                return None
+            self._entry = (credentials, time.perf_counter())
+            return credentials
+
+
+_caches = {}  # type: Dict[str, CredentialCache]
+_caches_lock = threading.Lock()
+
+
+def get_credential_cache(alias: str, provider: CredentialProvider, ttl: float) -> CredentialCache:
+    cache = _caches.get(alias)
+    if cache is None or cache.provider is not provider or cache.ttl != ttl:
+        with _caches_lock:
+            cache = _caches.get(alias)
+            if cache is None or cache.provider is not provider or cache.ttl != ttl:
+                cache = _caches[alias] = CredentialCache(alias, provider, ttl)
+    return cache
+
+
+def reset_credential_caches() -> None:
+    with _caches_lock:
+        _caches.clear()
+
+
+def refresh_credentials(dbwrapper: BaseDatabaseWrapper, provider: CredentialProvider, ttl: float,
+                        since: Optional[float] = None) -> bool:
+    """
+    Updates the ``settings_dict`` of ``dbwrapper`` with the credentials from
+    ``provider``, if they changed. Returns whether they did.
+    """
+    credentials = get_credential_cache(dbwrapper.alias, provider, ttl).get(since)
+    if credentials is None:
+        return False
+    changed = {key: value for key, value in credentials.items() if dbwrapper.settings_dict.get(key) != value}
+    if not changed:
+        return False
+    _log.info("Updating %s for database %s", ", ".join(sorted(changed)), dbwrapper.alias)
+    dbwrapper.settings_dict.update(changed)
+    return True
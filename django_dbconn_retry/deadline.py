@@ -0,0 +1,69 @@
+import contextlib
+import contextvars
+import logging
+import time
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from typing import Callable, Iterator, Optional  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+# the time.monotonic() by which the current request must be done with the database
+_deadline = contextvars.ContextVar("dbconn_retry_deadline", default=None)  # type: contextvars.ContextVar
+
+
+@contextlib.contextmanager
+def retry_deadline(timeout: float) -> Iterator[None]:
+    """
+    Limits the time that connecting to any database may take in the block,
+    including all retries and the delays between them, to ``timeout``
+    seconds. Retries stop once the next delay would end after the deadline.
+    Nested blocks can shorten the deadline, but not extend it.
+    """
+    deadline = time.monotonic() + timeout
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_deadline() -> Optional[float]:
+    """
+    Returns the ``time.monotonic()`` by which the current ``retry_deadline()``
+    block must be done or ``None`` outside of one.
+    """
+    return _deadline.get()
+
+
+class RequestDeadlineMiddleware:
+    """
+    Runs every request in a ``retry_deadline()`` block of
+    ``DBCONN_RETRY_REQUEST_TIMEOUT`` seconds, so a request doesn't wait for the
+    database longer than the load balancer waits for the response. Add it to
+    ``MIDDLEWARE`` to opt in. The setting is read once, when Django loads the
+    middleware.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+        timeout = getattr(settings, "DBCONN_RETRY_REQUEST_TIMEOUT", None)
+        # Validate the timeout, None disables it
+        if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+            _log.warning(
+                "Invalid DBCONN_RETRY_REQUEST_TIMEOUT setting %r; not limiting request time.",
+                timeout,
+            )
+            timeout = None
+        self.timeout = timeout  # type: Optional[float]
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        timeout = self.timeout
+        if timeout is None:
+            return self.get_response(request)
+        with retry_deadline(timeout):
+            return self.get_response(request)
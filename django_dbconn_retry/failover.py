@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+
+from django.db import DEFAULT_DB_ALIAS
+
+from django_dbconn_retry.breaker import get_breaker
+from django_dbconn_retry.policy import get_retry_policy
+
+from typing import Any, Dict, Optional, Type  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+# alias -> time.monotonic() until which the alias is considered down
+_down_until = {}  # type: Dict[str, float]
+_down_lock = threading.Lock()
+
+
+def mark_down(alias: str, cooldown: float) -> None:
+    """
+    Marks ``alias`` as unavailable for ``cooldown`` seconds. This is called
+    when an alias exhausts its retries.
+    """
+    with _down_lock:
+        if alias not in _down_until:
+            _log.warning("Marking database %s as down for %.2f seconds", alias, cooldown)
+        _down_until[alias] = time.monotonic() + cooldown
+
+
+def mark_up(alias: str) -> None:
+    """
+    Marks ``alias`` as available again. This is called for every new connection,
+    so it doesn't take the lock unless the alias was marked down.
+    """
+    if alias in _down_until:
+        with _down_lock:
+            if _down_until.pop(alias, None) is not None:
+                _log.info("Database %s is available again", alias)
+
+
+def reset_health() -> None:
+    with _down_lock:
+        _down_until.clear()
+
+
+def is_healthy(alias: str) -> bool:
+    """
+    Returns whether ``alias`` is worth connecting to: it hasn't recently
+    exhausted its retries and its circuit breaker (if enabled) isn't open.
+    """
+    down_until = _down_until.get(alias)
+    if down_until is not None and time.monotonic() < down_until:
+        return False
+    policy = get_retry_policy(alias)
+    breaker = get_breaker(alias, policy.breaker_threshold, policy.breaker_cooldown, policy.breaker_shared_dir)
+    return breaker is None or not breaker.is_open()
+
+
+def select_alias(alias: str) -> str:
+    """
+    Returns the first healthy alias of ``alias`` and its ``DBCONN_RETRY_FAILOVER``
+    chain. If none of them is healthy, ``alias`` itself is returned, so the
+    caller goes through the normal retry logic instead of failing outright.
+    """
+    if is_healthy(alias):
+        return alias
+    for candidate in get_retry_policy(alias).failover:
+        if is_healthy(candidate):
+            _log.debug("Database %s is down, using %s instead", alias, candidate)
+            return candidate
+    return alias
+
+
+class FailoverRouter:
+    """
+    A database router that sends reads to ``read_database`` or, while it's
+    down, to the first healthy alias of its ``DBCONN_RETRY_FAILOVER`` chain.
+    Subclass it and set ``read_database`` or override ``get_read_database()``
+    to pick the replica per model. Writes are left to the other routers.
+    """
+    read_database = DEFAULT_DB_ALIAS
+
+    def get_read_database(self, model: Type[Any], **hints: Any) -> str:
+        return self.read_database
+
+    def db_for_read(self, model: Type[Any], **hints: Any) -> Optional[str]:
+        return select_alias(self.get_read_database(model, **hints))
@@ -0,0 +1,118 @@
+import logging
+import threading
+
+from django.db.utils import OperationalError
+
+from django_dbconn_retry.classify import is_overload
+
+from typing import Dict, Optional  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+class ConnectLimitError(OperationalError):
+    """
+    Raised when a thread couldn't start a connection attempt before its
+    deadline (``DBCONN_RETRY_DEADLINE`` or ``retry_deadline()``) because of
+    the limit on concurrent attempts.
+    """
+    pass
+
+
+class ConnectLimiter:
+    """
+    An adaptive (AIMD) limit on how many threads of a process may connect to
+    one database alias at the same time.
+
+    As long as the database accepts connections there is no limit, or the
+    configured ``ceiling``. When it refuses a connection because it has too
+    many already, the limit is halved, so the next round of retries doesn't
+    saturate it again. Every successful connection raises the limit by one,
+    until it's back at the ceiling or, without one, at the concurrency at
+    which the database was overloaded, where the limit is lifted again.
+
+    The limit is only halved once per round: attempts that started before the
+    last decrease can't decrease it again.
+    """
+
+    def __init__(self, alias: str, ceiling: Optional[int] = None) -> None:
+        self.alias = alias
+        self.ceiling = ceiling
+        self.limit = ceiling  # type: Optional[int]
+        self.in_flight = 0
+        self._round = 0
+        self._recover_at = None  # type: Optional[int]
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Waits until this thread may connect. Returns a token for ``release()``
+        or ``None`` if ``timeout`` expired first.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.limit is None or self.in_flight < self.limit, timeout):
+                return None
+            self.in_flight += 1
+            return self._round
+
+    def release(self, token: int, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            concurrency = self.in_flight
+            self.in_flight -= 1
+            if error is not None:
+                if token == self._round and is_overload(error):
+                    self._decrease(concurrency)
+            elif self.limit is not None:
+                self._increase(self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, concurrency: int) -> None:
+        current = self.limit if self.limit is not None else concurrency
+        if self.ceiling is None:
+            self._recover_at = max(self._recover_at or 0, current)
+        self.limit = max(1, current // 2)
+        self._round += 1
+        _log.warning("Database %s has too many connections, allowing %d concurrent connection attempts",
+                     self.alias, self.limit)
+
+    def _increase(self, current: int) -> None:
+        self.limit = current + 1
+        if self.ceiling is not None:
+            self.limit = min(self.limit, self.ceiling)
+        elif self._recover_at is not None and self.limit >= self._recover_at:
+            _log.info("Lifting the limit of concurrent connection attempts to database %s", self.alias)
+            self.limit = None
+            self._recover_at = None
+
+
+_limiters = {}  # type: Dict[str, ConnectLimiter]
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(alias: str, ceiling: Optional[int] = None) -> ConnectLimiter:
+    limiter = _limiters.get(alias)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(alias, ConnectLimiter(alias, ceiling))
+    if limiter.ceiling != ceiling:
+        with limiter._cond:
+            limiter.ceiling = ceiling
+            limiter.limit = ceiling
+            limiter._recover_at = None
+            limiter._cond.notify_all()
+    return limiter
+
+
+def get_connect_limit(alias: str) -> Optional[int]:
+    """
+    Returns how many threads of this process may currently connect to
+    ``alias`` at the same time, or ``None`` if there is no limit.
+    """
+    limiter = _limiters.get(alias)
+    return limiter.limit if limiter is not None else None
+
+
+def reset_limiters() -> None:
+    with _limiters_lock:
+        _limiters.clear()
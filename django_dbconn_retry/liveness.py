@@ -0,0 +1,86 @@
+import errno
+import os
+import socket
+
+from typing import Any  # noqa. flake8 #118
+
+
+# libpq's PQTRANS_UNKNOWN, which psycopg2 and psycopg report for broken connections
+_PQTRANS_UNKNOWN = 4
+
+
+def _transaction_status(raw: Any) -> Any:
+    info = getattr(raw, "info", None)
+    if info is not None and hasattr(info, "transaction_status"):
+        # psycopg 3
+        return info.transaction_status
+    if hasattr(raw, "get_transaction_status"):
+        # psycopg2
+        return raw.get_transaction_status()
+    return None
+
+
+def _uses_tls(raw: Any) -> bool:
+    # psycopg2 exposes it on the connection info, psycopg 3 on the libpq connection
+    for holder in (getattr(raw, "info", None), getattr(raw, "pgconn", None)):
+        if getattr(holder, "ssl_in_use", False) is True:
+            return True
+    return False
+
+
+def _socket_is_alive(fd: int, vendor: str, tls: bool = False) -> bool:
+    """
+    Polls an idle client socket without blocking. An idle connection doesn't
+    expect data from the server, so a readable socket means that the server
+    has either closed it or sent something unsolicited. Peeks instead of
+    using select(), which can't handle descriptors above FD_SETSIZE.
+
+    Over TLS the peeked byte is the header of an encrypted record, which
+    can't be told apart from a notification and hides a following EOF, so
+    any pending data counts as a closed connection.
+    """
+    sock = socket.socket(fileno=os.dup(fd))
+    try:
+        data = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        return True
+    except OSError as e:
+        return e.errno not in (errno.ECONNRESET, errno.ENOTCONN, errno.EPIPE)
+    finally:
+        sock.close()
+    if data == b"":
+        # EOF
+        return False
+    if tls:
+        return False
+    if vendor == "postgresql" and data == b"E":
+        # an ErrorResponse while idle is the server terminating the session, e.g. during an admin shutdown.
+        # Unsolicited notifications and notices are fine.
+        return False
+    return True
+
+
+def connection_is_alive(raw: Any, vendor: str) -> bool:
+    """
+    Checks whether the driver connection ``raw`` still looks usable without a
+    round trip to the database server. It uses the driver's own state and, if
+    the driver exposes its socket through ``fileno()``, polls the socket for
+    an EOF or a termination message from the server. Over TLS, any data the
+    server sent to the idle connection counts as a termination. Drivers
+    without a socket (like sqlite) are always considered alive.
+    """
+    if getattr(raw, "closed", False):
+        return False
+    if _transaction_status(raw) == _PQTRANS_UNKNOWN:
+        return False
+    fileno = getattr(raw, "fileno", None)
+    if fileno is None:
+        return True
+    try:
+        fd = fileno()
+    except Exception:
+        # the driver refuses to hand out the socket of a closed connection
+        return False
+    if not isinstance(fd, int) or fd < 0:
+        return True
+    return _socket_is_alive(fd, vendor, _uses_tls(raw))
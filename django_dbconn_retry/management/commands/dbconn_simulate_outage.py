@@ -0,0 +1,151 @@
+import ast
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test.utils import override_settings
+
+from django_dbconn_retry.apps import pre_reconnect
+from django_dbconn_retry.backends import wrap_engine
+from django_dbconn_retry.backends.faultinjection.base import FaultInjectionMixin, Faults
+from django_dbconn_retry.backends.wrap.base import RetryMixin
+
+from typing import Any, Dict, List, NamedTuple, Tuple  # noqa. flake8 #118
+
+
+FAULT_INJECTION_ENGINE = "django_dbconn_retry.backends.faultinjection"
+RETRY_ENGINE = "django_dbconn_retry.backends.wrap"
+
+
+class Request(NamedTuple):
+    started: float
+    finished: float
+    ok: bool
+
+
+def _parse_setting(value: str) -> Tuple[str, Any]:
+    name, sep, literal = value.partition("=")
+    if not sep or not name:
+        raise CommandError("Settings must be given as NAME=VALUE, not %r." % value)
+    try:
+        return name, ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        return name, literal
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ("Simulates a database outage while several threads keep querying the database and reports how the "
+            "retry settings cope with it.")
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--database", default="default", choices=list(connections),
+                            help="The database to simulate the outage for.")
+        parser.add_argument("--threads", type=int, default=8, help="The number of threads sending queries.")
+        parser.add_argument("--duration", type=float, default=10.0, help="How many seconds to run.")
+        parser.add_argument("--outage-start", type=float, default=2.0,
+                            help="When the database becomes unreachable, in seconds after the start.")
+        parser.add_argument("--outage-length", type=float, default=3.0,
+                            help="For how many seconds the database is unreachable.")
+        parser.add_argument("--failure-rate", type=float, default=0.0,
+                            help="The share of connection attempts that fail outside of the outage.")
+        parser.add_argument("--latency", type=float, default=0.0,
+                            help="Seconds added to every connection attempt.")
+        parser.add_argument("--think-time", type=float, default=0.01,
+                            help="Seconds each thread waits between two requests.")
+        parser.add_argument("--override", action="append", dest="overrides", default=[], type=_parse_setting,
+                            metavar="NAME=VALUE",
+                            help="Overrides a setting, e.g. DBCONN_RETRY_DELAY=0.5. Can be given more than once.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options["threads"] < 1:
+            raise CommandError("At least one thread is required.")
+        with override_settings(**dict(options["overrides"])):
+            requests, retries = self.simulate(options)
+        self.report(requests, retries, options)
+
+    def create_connection(self, alias: str, faults: Faults) -> BaseDatabaseWrapper:
+        settings_dict = dict(connections[alias].settings_dict)
+        mixins = (FaultInjectionMixin,)  # type: Tuple[type, ...]
+        if settings_dict["ENGINE"] == RETRY_ENGINE:
+            # the database retries without monkeypatching, so keep doing that
+            mixins += (RetryMixin,)
+        elif settings_dict["ENGINE"] != FAULT_INJECTION_ENGINE:
+            settings_dict["WRAPPED_ENGINE"] = settings_dict["ENGINE"]
+        settings_dict["ENGINE"] = FAULT_INJECTION_ENGINE
+        dbwrapper = wrap_engine(settings_dict, *mixins)(settings_dict, alias)
+        dbwrapper.faults = faults  # type: ignore[attr-defined]
+        return dbwrapper
+
+    def simulate(self, options: Dict[str, Any]) -> Tuple[List[Request], int]:
+        alias = options["database"]
+        faults = Faults(options["failure_rate"], options["latency"],
+                        [(options["outage_start"], options["outage_length"])])
+        end = faults.epoch + options["duration"]
+        requests = []  # type: List[Request]
+        retries = [0]
+        lock = threading.Lock()
+
+        def count_retry(sender: Any, dbwrapper: BaseDatabaseWrapper, **kwargs: Any) -> None:
+            if dbwrapper.alias == alias:
+                with lock:
+                    retries[0] += 1
+
+        def send_requests() -> None:
+            dbwrapper = self.create_connection(alias, faults)
+            while time.monotonic() < end:
+                started = time.monotonic()
+                try:
+                    with dbwrapper.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    ok = True
+                except DatabaseError:
+                    ok = False
+                finally:
+                    # like Django does at the end of every request with CONN_MAX_AGE=0
+                    dbwrapper.close()
+                with lock:
+                    requests.append(Request(started, time.monotonic(), ok))
+                time.sleep(options["think_time"])
+
+        pre_reconnect.connect(count_retry)
+        try:
+            threads = [threading.Thread(target=send_requests, name="dbconn-outage-%d" % index)
+                       for index in range(options["threads"])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            pre_reconnect.disconnect(count_retry)
+        # report times relative to the start
+        return [Request(r.started - faults.epoch, r.finished - faults.epoch, r.ok) for r in requests], retries[0]
+
+    def report(self, requests: List[Request], retries: int, options: Dict[str, Any]) -> None:
+        if not requests:
+            raise CommandError("No requests were sent, increase --duration.")
+        outage_start = options["outage_start"]
+        outage_end = outage_start + options["outage_length"]
+        failed = [request for request in requests if not request.ok]
+        latencies = [(request.finished - request.started) * 1000 for request in requests]
+        self.stdout.write("requests:            %d" % len(requests))
+        self.stdout.write("failed requests:     %d (%.1f%%)" % (len(failed), len(failed) * 100 / len(requests)))
+        self.stdout.write("retries:             %d" % retries)
+        self.stdout.write("latency:             p50 %.1f ms, p99 %.1f ms, max %.1f ms" %
+                          (_percentile(latencies, 50), _percentile(latencies, 99), max(latencies)))
+        if options["outage_length"] <= 0:
+            return
+        self.stdout.write("outage:              %.2fs to %.2fs" % (outage_start, outage_end))
+        after = [request for request in failed if request.started >= outage_end]
+        self.stdout.write("failed after outage: %d" % len(after))
+        recovered = [request.finished for request in requests if request.ok and request.finished >= outage_end]
+        if recovered:
+            self.stdout.write("time to recovery:    %.1f ms" % ((min(recovered) - outage_end) * 1000))
+        else:
+            self.stdout.write("time to recovery:    didn't recover")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from django_dbconn_retry.warmup import warm_up
+
+from typing import Any  # noqa. flake8 #118
+
+
+class Command(BaseCommand):
+    help = "Connects to all configured databases concurrently and reports how long each connection took."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("--database", action="append", dest="databases", choices=list(connections),
+                            help="Only connect to this database. Can be given more than once.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        results = warm_up(options["databases"])
+        failed = []
+        for alias, result in results.items():
+            if result.ok:
+                self.stdout.write("%s: connected in %.1f ms" % (alias, result.elapsed * 1000))
+            else:
+                failed.append(alias)
+                self.stderr.write("%s: failed after %.1f ms: %s" % (alias, result.elapsed * 1000, result.error))
+        if failed:
+            raise CommandError("Couldn't connect to %s." % ", ".join(failed))
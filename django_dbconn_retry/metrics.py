@@ -0,0 +1,152 @@
+import bisect
+import threading
+
+from typing import Any, Dict, List, Optional, Tuple  # noqa. flake8 #118
+
+
+# connect latency histogram buckets in seconds, the same as the Prometheus client's defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class AliasMetrics:
+    """
+    Counters for the connection attempts to one database alias. Only actual
+    connection attempts are recorded, so using an established connection
+    doesn't pay anything.
+    """
+
+    def __init__(self) -> None:
+        self.attempts = 0
+        self.failures = {}  # type: Dict[str, int]
+        self.retries = 0
+        self.sleep_seconds = 0.0
+        self.query_retries = 0
+        # one count per bucket plus +Inf
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self._lock = threading.Lock()
+
+    def record_attempt(self, duration: float, error: Optional[BaseException] = None) -> None:
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, duration)
+        with self._lock:
+            self.attempts += 1
+            self.latency_buckets[bucket] += 1
+            self.latency_sum += duration
+            if error is not None:
+                name = "%s.%s" % (error.__class__.__module__, error.__class__.__qualname__)
+                self.failures[name] = self.failures.get(name, 0) + 1
+
+    def record_retry(self, delay: float) -> None:
+        with self._lock:
+            self.retries += 1
+            self.sleep_seconds += delay
+
+    def record_query_retry(self) -> None:
+        with self._lock:
+            self.query_retries += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            cumulative = 0
+            buckets = []  # type: List[Tuple[float, int]]
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.latency_buckets):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            return {
+                "attempts": self.attempts,
+                "failures": dict(self.failures),
+                "retries": self.retries,
+                "sleep_seconds": self.sleep_seconds,
+                "query_retries": self.query_retries,
+                "connect_latency": {
+                    "buckets": buckets,
+                    "sum": self.latency_sum,
+                    "count": self.attempts,
+                },
+            }
+
+
+_metrics = {}  # type: Dict[str, AliasMetrics]
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(alias: str) -> AliasMetrics:
+    try:
+        return _metrics[alias]
+    except KeyError:
+        with _metrics_lock:
+            return _metrics.setdefault(alias, AliasMetrics())
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns a snapshot of the connection metrics of this process by database
+    alias. For each alias this contains the number of connection
+    ``attempts``, ``failures`` by exception type, ``retries``, the total
+    ``sleep_seconds`` spent in backoff, the number of statements re-run by
+    ``QueryRetry`` (``query_retries``) and a cumulative ``connect_latency``
+    histogram.
+    """
+    return {alias: metrics.as_dict() for alias, metrics in list(_metrics.items())}
+
+
+def reset_stats() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus() -> str:
+    """
+    Renders ``stats()`` in the Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP dbconn_retry_connect_attempts_total Database connection attempts.",
+        "# TYPE dbconn_retry_connect_attempts_total counter",
+    ]
+    snapshot = stats()
+    for alias, data in snapshot.items():
+        lines.append('dbconn_retry_connect_attempts_total{alias="%s"} %d' % (_escape(alias), data["attempts"]))
+    lines += [
+        "# HELP dbconn_retry_connect_failures_total Failed database connection attempts by exception type.",
+        "# TYPE dbconn_retry_connect_failures_total counter",
+    ]
+    for alias, data in snapshot.items():
+        for error, count in sorted(data["failures"].items()):
+            lines.append('dbconn_retry_connect_failures_total{alias="%s",error="%s"} %d' %
+                         (_escape(alias), _escape(error), count))
+    lines += [
+        "# HELP dbconn_retry_retries_total Database connection retries.",
+        "# TYPE dbconn_retry_retries_total counter",
+    ]
+    for alias, data in snapshot.items():
+        lines.append('dbconn_retry_retries_total{alias="%s"} %d' % (_escape(alias), data["retries"]))
+    lines += [
+        "# HELP dbconn_retry_sleep_seconds_total Time spent waiting between database connection retries.",
+        "# TYPE dbconn_retry_sleep_seconds_total counter",
+    ]
+    for alias, data in snapshot.items():
+        lines.append('dbconn_retry_sleep_seconds_total{alias="%s"} %r' % (_escape(alias), data["sleep_seconds"]))
+    lines += [
+        "# HELP dbconn_retry_query_retries_total Statements re-run after the database connection broke.",
+        "# TYPE dbconn_retry_query_retries_total counter",
+    ]
+    for alias, data in snapshot.items():
+        lines.append('dbconn_retry_query_retries_total{alias="%s"} %d' % (_escape(alias), data["query_retries"]))
+    lines += [
+        "# HELP dbconn_retry_connect_latency_seconds Duration of database connection attempts.",
+        "# TYPE dbconn_retry_connect_latency_seconds histogram",
+    ]
+    for alias, data in snapshot.items():
+        latency = data["connect_latency"]
+        for bound, count in latency["buckets"]:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append('dbconn_retry_connect_latency_seconds_bucket{alias="%s",le="%s"} %d' %
+                         (_escape(alias), le, count))
+        lines.append('dbconn_retry_connect_latency_seconds_sum{alias="%s"} %r' % (_escape(alias), latency["sum"]))
+        lines.append('dbconn_retry_connect_latency_seconds_count{alias="%s"} %d' %
+                     (_escape(alias), latency["count"]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,301 @@
+import logging
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from django_dbconn_retry.backoff import BackoffStrategy, exponential, resolve_strategy
+from django_dbconn_retry.credentials import CredentialProvider
+
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Type  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+class RetryPolicy(NamedTuple):
+    """
+    The validated retry settings for one database alias. Policies are compiled
+    once and cached, so ``ensure_connection`` doesn't have to re-read and
+    re-validate the settings every time it's called.
+    """
+    max_retry_times: int = 1
+    retry_delay: float = 0
+    retry_backoff: float = 1
+    strategy: BackoffStrategy = exponential
+    max_delay: Optional[float] = None
+    deadline: Optional[float] = None
+    breaker_threshold: int = 0
+    breaker_cooldown: float = 30
+    breaker_shared_dir: Optional[str] = None
+    metrics: bool = True
+    liveness_interval: Optional[float] = None
+    failover: Tuple[str, ...] = ()
+    pool_size: int = 0
+    extra_exceptions: Tuple[Type[BaseException], ...] = ()
+    connect_concurrency: Optional[int] = None
+    singleflight_timeout: Optional[float] = None
+    log_interval: Optional[float] = None
+    credential_provider: Optional[CredentialProvider] = None
+    credential_ttl: float = 60
+
+    def get_delay(self, attempt: int, previous: float) -> float:
+        """
+        Returns the number of seconds to wait before retry ``attempt``.
+        """
+        delay = self.strategy(attempt, self.retry_delay, self.retry_backoff, previous)
+        if self.max_delay is not None and delay > self.max_delay:
+            return self.max_delay
+        return delay
+
+
+_policies = {}  # type: Dict[str, RetryPolicy]
+
+
+def _alias_overrides(alias: str) -> Dict[str, Any]:
+    overrides = settings.DATABASES.get(alias, {}).get("DBCONN_RETRY", {})
+    if not isinstance(overrides, dict):
+        _log.warning("Invalid DBCONN_RETRY block %r for database %s; ignoring it.", overrides, alias)
+        return {}
+    return overrides
+
+
+def build_policy(alias: str) -> RetryPolicy:
+    """
+    Builds the retry policy for ``alias``. Settings in the alias' ``DBCONN_RETRY``
+    block in ``DATABASES`` take precedence over the global settings.
+    """
+    overrides = _alias_overrides(alias)
+
+    def setting(name: str, default: Any) -> Any:
+        if name in overrides:
+            return overrides[name]
+        return getattr(settings, name, default)
+
+    max_retry_times = setting("MAX_DBCONN_RETRY_TIMES", 1)
+    # Validate and normalize max retry times to a non-negative integer
+    if not isinstance(max_retry_times, int) or max_retry_times < 0:
+        _log.warning(
+            "Invalid MAX_DBCONN_RETRY_TIMES setting %r for database %s; falling back to 1.",
+            max_retry_times, alias,
+        )
+        max_retry_times = 1
+    retry_delay = setting("DBCONN_RETRY_DELAY", 0)
+    # Validate and normalize retry delay to a non-negative number
+    if not isinstance(retry_delay, (int, float)) or retry_delay < 0:
+        _log.warning(
+            "Invalid DBCONN_RETRY_DELAY setting %r for database %s; falling back to 0 seconds.",
+            retry_delay, alias,
+        )
+        retry_delay = 0
+    retry_backoff = setting("DBCONN_RETRY_BACKOFF", 1)
+    # Validate and normalize backoff factor to a positive number
+    if not isinstance(retry_backoff, (int, float)) or retry_backoff <= 0:
+        _log.warning(
+            "Invalid DBCONN_RETRY_BACKOFF setting %r for database %s; falling back to 1.",
+            retry_backoff, alias,
+        )
+        retry_backoff = 1
+    strategy_setting = setting("DBCONN_RETRY_STRATEGY", "exponential")
+    try:
+        strategy = resolve_strategy(strategy_setting)
+    except ImportError:
+        _log.warning(
+            "Invalid DBCONN_RETRY_STRATEGY setting %r for database %s; falling back to exponential backoff.",
+            strategy_setting, alias,
+        )
+        strategy = exponential
+    max_delay = setting("DBCONN_RETRY_MAX_DELAY", None)
+    # Validate the cap, None disables it
+    if max_delay is not None and (not isinstance(max_delay, (int, float)) or max_delay < 0):
+        _log.warning(
+            "Invalid DBCONN_RETRY_MAX_DELAY setting %r for database %s; not capping delays.",
+            max_delay, alias,
+        )
+        max_delay = None
+    deadline = setting("DBCONN_RETRY_DEADLINE", None)
+    # Validate the deadline, None disables it
+    if deadline is not None and (not isinstance(deadline, (int, float)) or deadline <= 0):
+        _log.warning(
+            "Invalid DBCONN_RETRY_DEADLINE setting %r for database %s; not limiting total retry time.",
+            deadline, alias,
+        )
+        deadline = None
+    breaker_threshold = setting("DBCONN_RETRY_BREAKER_THRESHOLD", 0)
+    # Validate the circuit breaker threshold, 0 disables the breaker
+    if not isinstance(breaker_threshold, int) or breaker_threshold < 0:
+        _log.warning(
+            "Invalid DBCONN_RETRY_BREAKER_THRESHOLD setting %r for database %s; disabling the circuit breaker.",
+            breaker_threshold, alias,
+        )
+        breaker_threshold = 0
+    breaker_cooldown = setting("DBCONN_RETRY_BREAKER_COOLDOWN", 30)
+    if not isinstance(breaker_cooldown, (int, float)) or breaker_cooldown < 0:
+        _log.warning(
+            "Invalid DBCONN_RETRY_BREAKER_COOLDOWN setting %r for database %s; falling back to 30 seconds.",
+            breaker_cooldown, alias,
+        )
+        breaker_cooldown = 30
+    breaker_shared_dir = setting("DBCONN_RETRY_BREAKER_SHARED_DIR", None)
+    if breaker_shared_dir is not None and not isinstance(breaker_shared_dir, str):
+        _log.warning(
+            "Invalid DBCONN_RETRY_BREAKER_SHARED_DIR setting %r for database %s; not sharing breaker state.",
+            breaker_shared_dir, alias,
+        )
+        breaker_shared_dir = None
+    metrics = bool(setting("DBCONN_RETRY_METRICS", True))
+    liveness_interval = setting("DBCONN_RETRY_LIVENESS_INTERVAL", None)
+    # Validate the liveness check interval, None disables the check
+    if liveness_interval is not None and (not isinstance(liveness_interval, (int, float)) or liveness_interval < 0):
+        _log.warning(
+            "Invalid DBCONN_RETRY_LIVENESS_INTERVAL setting %r for database %s; disabling liveness checks.",
+            liveness_interval, alias,
+        )
+        liveness_interval = None
+    failover_setting = setting("DBCONN_RETRY_FAILOVER", ())
+    # Validate the failover chain, it may only contain other configured aliases
+    if not isinstance(failover_setting, (list, tuple)) or not all(isinstance(a, str) for a in failover_setting):
+        _log.warning(
+            "Invalid DBCONN_RETRY_FAILOVER setting %r for database %s; not failing over.",
+            failover_setting, alias,
+        )
+        failover_setting = ()
+    unknown = [a for a in failover_setting if a not in settings.DATABASES]
+    if unknown:
+        _log.warning(
+            "DBCONN_RETRY_FAILOVER setting for database %s contains unknown databases %r; ignoring them.",
+            alias, unknown,
+        )
+    failover = tuple(a for a in failover_setting if a != alias and a not in unknown)
+    pool_size = setting("DBCONN_RETRY_POOL_SIZE", 0)
+    # Validate the pool size, 0 disables pooling
+    if not isinstance(pool_size, int) or pool_size < 0:
+        _log.warning(
+            "Invalid DBCONN_RETRY_POOL_SIZE setting %r for database %s; not pooling connections.",
+            pool_size, alias,
+        )
+        pool_size = 0
+    extra_exceptions = ()  # type: Tuple[Type[BaseException], ...]
+    extra_exceptions_setting = setting("DBCONN_RETRY_EXTRA_EXCEPTIONS", ())
+    if not isinstance(extra_exceptions_setting, (list, tuple)):
+        _log.warning(
+            "Invalid DBCONN_RETRY_EXTRA_EXCEPTIONS setting %r for database %s; it must be a list.",
+            extra_exceptions_setting, alias,
+        )
+        extra_exceptions_setting = ()
+    # Resolve the dotted paths of additional retryable exceptions, skipping the invalid ones
+    for exception in extra_exceptions_setting:
+        try:
+            exception_type = import_string(exception) if isinstance(exception, str) else exception
+        except (ImportError, ValueError, TypeError):
+            # import_module() raises ValueError for empty and TypeError for relative module names
+            exception_type = None
+        if not isinstance(exception_type, type) or not issubclass(exception_type, BaseException):
+            _log.warning(
+                "Invalid DBCONN_RETRY_EXTRA_EXCEPTIONS entry %r for database %s; ignoring it.",
+                exception, alias,
+            )
+            continue
+        extra_exceptions += (exception_type,)
+    connect_concurrency = setting("DBCONN_RETRY_CONNECT_CONCURRENCY", None)
+    # Validate the ceiling for concurrent connection attempts, None only limits them when the database is overloaded
+    if connect_concurrency is not None and (not isinstance(connect_concurrency, int) or connect_concurrency < 1):
+        _log.warning(
+            "Invalid DBCONN_RETRY_CONNECT_CONCURRENCY setting %r for database %s; not limiting concurrency.",
+            connect_concurrency, alias,
+        )
+        connect_concurrency = None
+    singleflight_timeout = setting("DBCONN_RETRY_SINGLEFLIGHT_TIMEOUT", None)
+    # Validate how long threads wait for another thread's reconnect, None makes every thread retry on its own
+    if singleflight_timeout is not None and (not isinstance(singleflight_timeout, (int, float)) or
+                                             singleflight_timeout <= 0):
+        _log.warning(
+            "Invalid DBCONN_RETRY_SINGLEFLIGHT_TIMEOUT setting %r for database %s; not coordinating reconnects.",
+            singleflight_timeout, alias,
+        )
+        singleflight_timeout = None
+    log_interval = setting("DBCONN_RETRY_LOG_INTERVAL", None)
+    # Validate the interval for summarizing failed attempts, None logs every one of them
+    if log_interval is not None and (not isinstance(log_interval, (int, float)) or log_interval <= 0):
+        _log.warning(
+            "Invalid DBCONN_RETRY_LOG_INTERVAL setting %r for database %s; logging every failed attempt.",
+            log_interval, alias,
+        )
+        log_interval = None
+    credential_provider = setting("DBCONN_RETRY_CREDENTIAL_PROVIDER", None)
+    # Resolve the dotted path of the credential provider, None leaves refreshing credentials to pre_reconnect
+    if isinstance(credential_provider, str):
+        try:
+            credential_provider = import_string(credential_provider)
+        except ImportError:
+            pass
+    if credential_provider is not None and not callable(credential_provider):
+        _log.warning(
+            "Invalid DBCONN_RETRY_CREDENTIAL_PROVIDER setting %r for database %s; not refreshing credentials.",
+            credential_provider, alias,
+        )
+        credential_provider = None
+    credential_ttl = setting("DBCONN_RETRY_CREDENTIAL_TTL", 60)
+    # Validate how long fetched credentials are reused
+    if not isinstance(credential_ttl, (int, float)) or credential_ttl < 0:
+        _log.warning(
+            "Invalid DBCONN_RETRY_CREDENTIAL_TTL setting %r for database %s; caching credentials for 60 seconds.",
+            credential_ttl, alias,
+        )
+        credential_ttl = 60
+
+    return RetryPolicy(
+        max_retry_times=max_retry_times,
+        retry_delay=retry_delay,
+        retry_backoff=retry_backoff,
+        strategy=strategy,
+        max_delay=max_delay,
+        deadline=deadline,
+        breaker_threshold=breaker_threshold,
+        breaker_cooldown=breaker_cooldown,
+        breaker_shared_dir=breaker_shared_dir,
+        metrics=metrics,
+        liveness_interval=liveness_interval,
+        failover=failover,
+        pool_size=pool_size,
+        extra_exceptions=extra_exceptions,
+        connect_concurrency=connect_concurrency,
+        singleflight_timeout=singleflight_timeout,
+        log_interval=log_interval,
+        credential_provider=credential_provider,
+        credential_ttl=credential_ttl,
+    )
+
+
+def get_retry_policy(alias: str) -> RetryPolicy:
+    try:
+        return _policies[alias]
+    except KeyError:
+        policy = _policies[alias] = build_policy(alias)
+        return policy
+
+
+def build_policies() -> None:
+    """
+    Compiles the retry policies for all configured database aliases.
+    """
+    _policies.clear()
+    for alias in settings.DATABASES:
+        _policies[alias] = build_policy(alias)
+
+
+def clear_policies() -> None:
+    _policies.clear()
+
+
+def _is_retry_setting(setting: str) -> bool:
+    return setting in ("DATABASES", "MAX_DBCONN_RETRY_TIMES") or setting.startswith("DBCONN_RETRY_")
+
+
+def _invalidate_policies(sender: Any, *, setting: str, **kwargs: Any) -> None:
+    # keeps override_settings() working in test suites
+    if _is_retry_setting(setting):
+        clear_policies()
+
+
+setting_changed.connect(_invalidate_policies, dispatch_uid="django_dbconn_retry.policy")
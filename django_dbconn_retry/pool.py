@@ -0,0 +1,169 @@
+import collections
+import logging
+import os
+import threading
+
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from django_dbconn_retry.liveness import connection_is_alive
+from django_dbconn_retry.state import get_state
+
+from typing import Any, Callable, Deque, Dict, Optional  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+def _close_quietly(raw: Any) -> None:
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    A bounded pool of idle driver connections for one database alias, shared
+    by all threads of a process. Django still owns one connection per thread
+    and alias, but instead of closing it at the end of a request it's returned
+    here and handed to the next thread that connects.
+
+    Idle connections are checked with ``connection_is_alive()`` on checkout and
+    broken ones are evicted. At most ``size`` connections are kept idle, the
+    rest are closed when they're returned.
+    """
+
+    def __init__(self, alias: str, vendor: str, size: int) -> None:
+        self.alias = alias
+        self.vendor = vendor
+        self.size = size
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self._idle = collections.deque()  # type: Deque[Any]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_pid(self) -> None:
+        # the sockets of inherited connections are shared with the parent process, so they must neither be used
+        # nor closed (which would terminate the parent's session) in a forked child
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = collections.deque()
+
+    def checkout(self, connect: Callable[[], Any]) -> Any:
+        """
+        Returns an idle connection that is still alive or creates a new one by
+        calling ``connect``.
+        """
+        while True:
+            with self._lock:
+                self._check_pid()
+                # LIFO, so the least recently used connections can age out on the server
+                raw = self._idle.pop() if self._idle else None
+            if raw is None:
+                break
+            if connection_is_alive(raw, self.vendor):
+                self.reused += 1
+                return raw
+            _log.debug("evicting broken pooled connection to database %s", self.alias)
+            self.evicted += 1
+            _close_quietly(raw)
+        raw = connect()
+        self.created += 1
+        return raw
+
+    def checkin(self, raw: Any) -> None:
+        """
+        Returns ``raw`` to the pool. Open transactions are rolled back and
+        connections that are broken or don't fit into the pool are closed.
+        """
+        try:
+            raw.rollback()
+        except Exception:
+            self.evicted += 1
+            _close_quietly(raw)
+            return
+        if connection_is_alive(raw, self.vendor):
+            with self._lock:
+                self._check_pid()
+                if len(self._idle) < self.size:
+                    self._idle.append(raw)
+                    return
+        _close_quietly(raw)
+
+    def clear(self) -> None:
+        """
+        Closes all idle connections, e.g. because connecting to the database
+        just failed and they're most likely broken as well.
+        """
+        with self._lock:
+            self._check_pid()
+            idle, self._idle = self._idle, collections.deque()
+        for raw in idle:
+            _close_quietly(raw)
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+
+_pools = {}  # type: Dict[str, ConnectionPool]
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str) -> Optional[ConnectionPool]:
+    return _pools.get(alias)
+
+
+def attach_pool(dbwrapper: BaseDatabaseWrapper, size: int) -> Optional[ConnectionPool]:
+    """
+    Makes ``dbwrapper`` take its connections from and return them to the pool
+    for its alias, which keeps up to ``size`` idle connections. A ``size`` of
+    0 detaches the pool again. Returns the pool.
+
+    Only ``get_new_connection()`` and ``_close()`` are replaced on the
+    instance, so Django still runs its connection setup for every checkout
+    and the retry logic still applies when new connections are created.
+    """
+    state = get_state(dbwrapper)
+    attached = state.pool  # type: Optional[ConnectionPool]
+    if size == 0:
+        if attached is not None:
+            del dbwrapper.get_new_connection, dbwrapper._close  # type: ignore[attr-defined]
+            state.pool = None
+        return None
+
+    pool = _pools.get(dbwrapper.alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(dbwrapper.alias, ConnectionPool(dbwrapper.alias, dbwrapper.vendor, size))
+    pool.size = size
+    if attached is pool:
+        return pool
+
+    cls = type(dbwrapper)
+
+    def get_new_connection(conn_params: Dict[str, Any]) -> Any:
+        return pool.checkout(lambda: cls.get_new_connection(dbwrapper, conn_params))
+
+    def _close() -> None:
+        raw = dbwrapper.connection
+        if raw is None:
+            return
+        if dbwrapper.in_atomic_block:
+            # Django keeps the closed connection around until the atomic block exits, so it can't be reused
+            cls._close(dbwrapper)  # type: ignore[attr-defined]
+        else:
+            pool.checkin(raw)
+
+    dbwrapper.get_new_connection = get_new_connection  # type: ignore
+    dbwrapper._close = _close  # type: ignore
+    state.pool = pool
+    return pool
+
+
+def reset_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.clear()
+        _pools.clear()
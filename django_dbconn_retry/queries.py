@@ -0,0 +1,139 @@
+import contextlib
+import contextvars
+import logging
+import re
+import time
+
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.utils import Error, InterfaceError, OperationalError
+from django.http import HttpRequest, HttpResponse
+
+from django_dbconn_retry.apps import pre_reconnect, post_reconnect
+from django_dbconn_retry.liveness import connection_is_alive
+from django_dbconn_retry.metrics import get_metrics
+from django_dbconn_retry.policy import get_retry_policy
+
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+_idempotent = contextvars.ContextVar("dbconn_retry_idempotent", default=False)
+
+# statements that are safe to run twice. Leading whitespace and parentheses are allowed.
+_read_only_re = re.compile(r"^[\s(]*SELECT\b", re.IGNORECASE)
+
+
+@contextlib.contextmanager
+def idempotent() -> Iterator[None]:
+    """
+    Marks all statements executed in the block as safe to re-run, so
+    ``QueryRetry`` retries them even though they aren't ``SELECT`` statements.
+    """
+    token = _idempotent.set(True)
+    try:
+        yield
+    finally:
+        _idempotent.reset(token)
+
+
+def is_retryable_statement(sql: str, many: bool) -> bool:
+    if _idempotent.get():
+        return True
+    return not many and _read_only_re.match(sql) is not None
+
+
+class QueryRetry:
+    """
+    An execute wrapper (see ``connection.execute_wrapper()``) that transparently
+    reconnects and re-runs a statement when the connection broke while
+    running it. It only does so outside of transactions and for statements
+    that are safe to run twice: ``SELECT`` statements and statements executed
+    in an ``idempotent()`` block. Each statement is retried up to
+    ``MAX_DBCONN_RETRY_TIMES`` times. Reconnecting goes through the normal
+    retry logic and sends ``pre_reconnect`` and ``post_reconnect``.
+    """
+
+    def __call__(self, execute: Callable[..., Any], sql: str, params: Any, many: bool,
+                 context: Dict[str, Any]) -> Any:
+        dbwrapper = context["connection"]  # type: BaseDatabaseWrapper
+        attempt = 0
+        while True:
+            try:
+                return execute(sql, params, many, context)
+            except (OperationalError, InterfaceError) as e:
+                policy = get_retry_policy(dbwrapper.alias)
+                if attempt >= policy.max_retry_times or not self._can_retry(dbwrapper, context, sql, many, e):
+                    raise
+                attempt += 1
+                _log.info("Connection to database %s broke while executing a statement, re-running it (%d)",
+                          dbwrapper.alias, attempt)
+                if policy.metrics:
+                    get_metrics(dbwrapper.alias).record_query_retry()
+                self._reconnect(dbwrapper, context, attempt, e)
+
+    def _can_retry(self, dbwrapper: BaseDatabaseWrapper, context: Dict[str, Any], sql: str, many: bool,
+                   error: Error) -> bool:
+        # OperationalErrors are also raised for timeouts or missing tables, so only retry if the connection
+        # itself is broken. This has to be checked first: anything that calls ensure_connection(), like
+        # get_autocommit(), would replace a connection that the driver marked as closed behind our back.
+        if not (
+            isinstance(error, InterfaceError) or
+            dbwrapper.connection is None or
+            not connection_is_alive(dbwrapper.connection, dbwrapper.vendor)
+        ):
+            return False
+        if dbwrapper.in_atomic_block or not dbwrapper.autocommit:
+            return False
+        if not is_retryable_statement(sql, many):
+            return False
+        if getattr(context["cursor"].cursor, "name", None):
+            # server-side cursors live on the old connection
+            return False
+        return True
+
+    def _reconnect(self, dbwrapper: BaseDatabaseWrapper, context: Dict[str, Any], attempt: int,
+                   error: Error) -> None:
+        try:
+            dbwrapper.close()
+        except Error:
+            # closing a dead connection can fail as well, e.g. with an InterfaceError
+            dbwrapper.connection = None
+        # give libraries like 12factor-vault the chance to update the credentials
+        pre_reconnect.send(dbwrapper.__class__, dbwrapper=dbwrapper, attempt=attempt, backoff_time=0.0,
+                           exception=error)
+        connect_started = time.perf_counter()
+        dbwrapper.ensure_connection()
+        post_reconnect.send(dbwrapper.__class__, dbwrapper=dbwrapper, attempt=attempt,
+                            elapsed=time.perf_counter() - connect_started, backoff_time=0.0, exception=None)
+        with dbwrapper.wrap_database_errors:
+            # execute() runs the statement on context["cursor"].cursor
+            context["cursor"].cursor = dbwrapper.create_cursor()
+
+
+@contextlib.contextmanager
+def retry_queries(using: Optional[Iterable[str]] = None) -> Iterator[None]:
+    """
+    Installs ``QueryRetry`` on the connections to the databases in ``using``
+    (all configured databases by default) for the duration of the block.
+    """
+    aliases = list(using) if using is not None else list(connections)
+    with contextlib.ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(QueryRetry()))
+        yield
+
+
+class QueryRetryMiddleware:
+    """
+    Re-runs safe statements that failed because the database connection broke
+    for every request. Add it to ``MIDDLEWARE`` to opt in.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with retry_queries():
+            return self.get_response(request)
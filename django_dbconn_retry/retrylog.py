@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from typing import Any, Dict, Optional, Tuple  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+def _error_class(error: BaseException) -> str:
+    return "%s.%s" % (error.__class__.__module__, error.__class__.__qualname__)
+
+
+class RetryLog:
+    """
+    Logs the failed connection attempts to one database alias for all threads
+    of a process. Every record carries the ``alias``, ``attempt``, ``delay``,
+    ``error_class`` and ``host`` as attributes for structured logging.
+
+    With an ``interval``, only the first failure in every interval is logged
+    on its own. The others are counted and summarized once the interval is
+    over, so an outage doesn't produce a log line per attempt per thread.
+    """
+
+    def __init__(self, alias: str, interval: Optional[float] = None) -> None:
+        self.alias = alias
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._window = None  # type: Optional[float]
+        self._failed = 0
+        self._gave_up = 0
+        self._errors = {}  # type: Dict[str, int]
+
+    def retrying(self, dbwrapper: BaseDatabaseWrapper, attempt: int, delay: float, error: BaseException) -> None:
+        if self._admit(error, gave_up=False):
+            _log.info("Connecting to database %s failed (%s), retry %d in %.2f seconds",
+                      self.alias, error, attempt, delay, extra=self._extra(dbwrapper, attempt, delay, error))
+
+    def gave_up(self, dbwrapper: BaseDatabaseWrapper, message: str, attempt: int, error: BaseException,
+                level: int = logging.ERROR) -> None:
+        """
+        Logs that connecting failed for good. ``message`` is formatted with the
+        error.
+        """
+        if self._admit(error, gave_up=True):
+            _log.log(level, message, str(error), extra=self._extra(dbwrapper, attempt, None, error))
+
+    def flush(self) -> None:
+        """
+        Logs the summary of the current interval right away and starts a new
+        one with the next failure.
+        """
+        if self._window is None:
+            # nothing failed since the last summary
+            return
+        with self._lock:
+            summary = self._take_summary(None)
+        if summary is not None:
+            self._log_summary(*summary)
+
+    def _extra(self, dbwrapper: BaseDatabaseWrapper, attempt: int, delay: Optional[float],
+               error: BaseException) -> Dict[str, Any]:
+        return {
+            "alias": self.alias,
+            "attempt": attempt,
+            "delay": delay,
+            "error_class": _error_class(error),
+            "host": dbwrapper.settings_dict.get("HOST") or None,
+        }
+
+    def _admit(self, error: BaseException, gave_up: bool) -> bool:
+        # returns whether the failure should be logged on its own
+        if self.interval is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self._window is not None and now - self._window < self.interval:
+                self._failed += 1
+                self._gave_up += gave_up
+                name = _error_class(error)
+                self._errors[name] = self._errors.get(name, 0) + 1
+                return False
+            summary = self._take_summary(now)
+        if summary is not None:
+            self._log_summary(*summary)
+        return True
+
+    def _take_summary(self, now: Optional[float]) -> Optional[Tuple[int, int, Dict[str, int], float]]:
+        # must be called with the lock held, starts a new interval at now
+        summary = None
+        # failures are only counted within an interval, so _window is set if there are any
+        if self._failed and self._window is not None:
+            elapsed = (now if now is not None else time.monotonic()) - self._window
+            if self.interval is not None:
+                # all of them failed within one interval, no matter how much later the summary is logged
+                elapsed = min(elapsed, self.interval)
+            summary = (self._failed, self._gave_up, self._errors, elapsed)
+        self._window = now
+        self._failed = self._gave_up = 0
+        self._errors = {}
+        return summary
+
+    def _log_summary(self, failed: int, gave_up: int, errors: Dict[str, int], elapsed: float) -> None:
+        _log.warning(
+            "%d more failed connection attempts to database %s within %.0fs, %d of which gave up (%s)",
+            failed, self.alias, elapsed, gave_up,
+            ", ".join("%s: %d" % error for error in sorted(errors.items(), key=lambda item: -item[1])),
+            extra={"alias": self.alias, "failed_attempts": failed, "gave_up": gave_up, "errors": errors},
+        )
+
+
+_retry_logs = {}  # type: Dict[str, RetryLog]
+_retry_logs_lock = threading.Lock()
+
+
+def get_retry_log(alias: str, interval: Optional[float] = None) -> RetryLog:
+    retry_log = _retry_logs.get(alias)
+    if retry_log is None:
+        with _retry_logs_lock:
+            retry_log = _retry_logs.setdefault(alias, RetryLog(alias, interval))
+    retry_log.interval = interval
+    return retry_log
+
+
+def reset_retry_logs() -> None:
+    with _retry_logs_lock:
+        _retry_logs.clear()
@@ -0,0 +1,78 @@
+import logging
+import threading
+
+from typing import Dict, Optional, Tuple  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    One thread's attempt to reconnect to a database after a failure, which
+    other threads wait for instead of retrying on their own.
+    """
+    __slots__ = ("ok", "_landed")
+
+    def __init__(self) -> None:
+        self.ok = False
+        self._landed = threading.Event()
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """
+        Waits for the reconnect to finish. Returns whether it succeeded within
+        ``timeout`` seconds.
+        """
+        return self._landed.wait(timeout) and self.ok
+
+
+class Singleflight:
+    """
+    Coordinates reconnecting to one database alias between the threads of a
+    process. The first thread whose connection attempt fails becomes the
+    leader and runs the retry loop with its backoff. Threads failing while
+    it's in progress wait for the leader's outcome and only connect again,
+    each with its own connection, once the leader got through. So a blip
+    costs one probing connection attempt per backoff step instead of one
+    per thread.
+    """
+
+    def __init__(self, alias: str) -> None:
+        self.alias = alias
+        self._flight = None  # type: Optional[Flight]
+        self._lock = threading.Lock()
+
+    def join(self) -> Tuple[Flight, bool]:
+        """
+        Returns the reconnect in progress and whether the calling thread
+        started it and must therefore ``land()`` it.
+        """
+        with self._lock:
+            if self._flight is None:
+                self._flight = Flight()
+                return self._flight, True
+            return self._flight, False
+
+    def land(self, flight: Flight, ok: bool) -> None:
+        with self._lock:
+            if self._flight is flight:
+                self._flight = None
+        flight.ok = ok
+        flight._landed.set()
+
+
+_singleflights = {}  # type: Dict[str, Singleflight]
+_singleflights_lock = threading.Lock()
+
+
+def get_singleflight(alias: str) -> Singleflight:
+    singleflight = _singleflights.get(alias)
+    if singleflight is None:
+        with _singleflights_lock:
+            singleflight = _singleflights.setdefault(alias, Singleflight(alias))
+    return singleflight
+
+
+def reset_singleflights() -> None:
+    with _singleflights_lock:
+        _singleflights.clear()
@@ -0,0 +1,51 @@
+import threading
+
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from typing import Any, Optional  # noqa. flake8 #118
+
+
+class RetryState:
+    """
+    The retry state of one database connection. It's kept in a single
+    attribute of the ``BaseDatabaseWrapper`` instead of several ad-hoc ones.
+
+    ``lock`` serializes connecting for wrappers that are shared between
+    threads (see ``BaseDatabaseWrapper.inc_thread_sharing()``). It's
+    reentrant, because connecting runs queries that call
+    ``ensure_connection`` again.
+    """
+    __slots__ = ("retries", "connecting", "liveness_checked", "pool", "lock")
+
+    def __init__(self) -> None:
+        # only reset by a successful connection
+        self.retries = 0
+        self.connecting = False
+        self.liveness_checked = 0.0
+        self.pool = None  # type: Optional[Any]
+        self.lock = threading.RLock()
+
+
+def get_state(dbwrapper: BaseDatabaseWrapper) -> RetryState:
+    try:
+        return dbwrapper.__dict__["_dbconn_retry_state"]
+    except KeyError:
+        # setdefault() is atomic, so threads sharing the wrapper can't end up with different states
+        return dbwrapper.__dict__.setdefault("_dbconn_retry_state", RetryState())
+
+
+def _get_connection_retries(dbwrapper: BaseDatabaseWrapper) -> int:
+    return get_state(dbwrapper).retries
+
+
+def _set_connection_retries(dbwrapper: BaseDatabaseWrapper, retries: int) -> None:
+    get_state(dbwrapper).retries = retries
+
+
+def _reset_connection_retries(dbwrapper: BaseDatabaseWrapper) -> None:
+    get_state(dbwrapper).retries = 0
+
+
+# BaseDatabaseWrapper._connection_retries used to be a plain attribute, which code outside of this library reads
+# and resets
+connection_retries = property(_get_connection_retries, _set_connection_retries, _reset_connection_retries)
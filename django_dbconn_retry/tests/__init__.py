@@ -1,17 +1,57 @@
 # -* encoding: utf-8 *-
+import asyncio
+import io
+import multiprocessing
+import os
 import random
+import socket
+import sqlite3
 import sys
 import logging
+import tempfile
+import threading
+import time
 
 from unittest.mock import Mock, patch
 
-from typing import Any
+from typing import Any, Callable, Dict, List, Optional, Tuple  # noqa. flake8 #118
 
 import django_dbconn_retry as ddr
+from django_dbconn_retry import views as ddr_views
+from django_dbconn_retry.apps import _django_ensure_connection, ensure_connection_with_retries, \
+    get_retryable_errors
+from django_dbconn_retry.backends import wrap_engine
+from django_dbconn_retry.backends.faultinjection.base import DatabaseWrapper as FaultInjectionWrapper, \
+    FaultInjectionMixin, Faults, reset_faults
+from django_dbconn_retry.backends.wrap.base import DatabaseWrapper as RetryWrapper
+from django_dbconn_retry.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, SharedBreakerState, \
+    get_breaker, reset_breakers
+from django_dbconn_retry.classify import AUTH, PERMANENT, TRANSIENT, classify_error, is_overload
+from django_dbconn_retry.credentials import CredentialCache, refresh_credentials, reset_credential_caches
+from django_dbconn_retry.deadline import RequestDeadlineMiddleware, get_deadline
+from django_dbconn_retry.failover import FailoverRouter, is_healthy, mark_down, mark_up, reset_health, \
+    select_alias
+from django_dbconn_retry.limiter import ConnectLimiter, ConnectLimitError, get_limiter, reset_limiters
+from django_dbconn_retry.liveness import connection_is_alive
+from django_dbconn_retry.metrics import reset_stats
+from django_dbconn_retry.policy import clear_policies
+from django_dbconn_retry.pool import ConnectionPool, get_pool, reset_pools
+from django_dbconn_retry.queries import QueryRetry, QueryRetryMiddleware, idempotent, retry_queries
+from django_dbconn_retry.retrylog import RetryLog, reset_retry_logs
+from django_dbconn_retry.singleflight import Singleflight, get_singleflight, reset_singleflights
+from django_dbconn_retry.state import RetryState, get_state
+from django_dbconn_retry.warmup import WarmupResult, post_fork, post_worker_init, warm_up
 
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
 from django.db.backends.base.base import BaseDatabaseWrapper
-from django.db import connection, OperationalError, ProgrammingError, transaction
+from django.db import connection, connections, InterfaceError, OperationalError, ProgrammingError, transaction
+from django.http import HttpRequest, HttpResponse
 from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import path
 
 
 logging.basicConfig(stream=sys.stderr)
@@ -254,3 +294,1734 @@ class AtomicBlockTests(TransactionTestCase):
         with transaction.atomic():
             connection.ensure_connection()
             self.assertTrue(connection.is_usable())
+
+
+class RetryPolicyTests(TestCase):
+    """
+    Tests for the compiled and cached per-alias retry policies.
+    """
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=5, DBCONN_RETRY_DELAY=0.5, DBCONN_RETRY_BACKOFF=3)
+    def test_policy_reflects_settings(self) -> None:
+        self.assertEqual(ddr.get_retry_policy("default"), ddr.RetryPolicy(5, 0.5, 3))
+
+    def test_policy_is_cached(self) -> None:
+        policy = ddr.get_retry_policy("default")
+        with patch("django_dbconn_retry.policy.build_policy") as build:
+            self.assertIs(ddr.get_retry_policy("default"), policy)
+            build.assert_not_called()
+
+    def test_policy_invalidated_by_setting_changed(self) -> None:
+        before = ddr.get_retry_policy("default")
+        with override_settings(MAX_DBCONN_RETRY_TIMES=before.max_retry_times + 1):
+            self.assertEqual(ddr.get_retry_policy("default").max_retry_times, before.max_retry_times + 1)
+        self.assertEqual(ddr.get_retry_policy("default"), before)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES="invalid")
+    def test_invalid_setting_warns_once(self) -> None:
+        with self.assertLogs("django_dbconn_retry.policy", logging.WARNING) as logs:
+            ddr.get_retry_policy("default")
+            ddr.get_retry_policy("default")
+        self.assertEqual(len(logs.records), 1)
+
+    def test_alias_block_overrides_global_settings(self) -> None:
+        block = {"MAX_DBCONN_RETRY_TIMES": 0, "DBCONN_RETRY_DELAY": 0.1}
+        with override_settings(MAX_DBCONN_RETRY_TIMES=7, DBCONN_RETRY_BACKOFF=2), \
+                patch.dict(settings.DATABASES["default"], {"DBCONN_RETRY": block}):
+            clear_policies()
+            self.assertEqual(ddr.get_retry_policy("default"), ddr.RetryPolicy(0, 0.1, 2))
+        clear_policies()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=4)
+    def test_unknown_alias_uses_global_settings(self) -> None:
+        self.assertEqual(ddr.get_retry_policy("not-configured").max_retry_times, 4)
+
+    def test_alias_policy_used_by_ensure_connection(self) -> None:
+        s_connect = BaseDatabaseWrapper.connect
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('alias policy testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+        try:
+            with override_settings(MAX_DBCONN_RETRY_TIMES=5), \
+                    patch.dict(settings.DATABASES["default"], {"DBCONN_RETRY": {"MAX_DBCONN_RETRY_TIMES": 2}}):
+                clear_policies()
+                self.assertRaises(OperationalError, connection.ensure_connection)
+                self.assertEqual(BaseDatabaseWrapper.connect.call_count, 3)
+        finally:
+            BaseDatabaseWrapper.connect = s_connect
+            del BaseDatabaseWrapper.connection
+            del connection._connection_retries
+            clear_policies()
+
+
+def constant_backoff(attempt: int, delay: float, backoff: float, previous: float) -> float:
+    return 0.25
+
+
+class BackoffStrategyTests(TestCase):
+    """
+    Tests for the pluggable backoff strategies, the delay cap and the retry deadline.
+    """
+
+    def setUp(self) -> None:
+        self.s_connect = BaseDatabaseWrapper.connect
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('strategy testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+
+    def tearDown(self) -> None:
+        BaseDatabaseWrapper.connect = self.s_connect
+        del BaseDatabaseWrapper.connection
+        if hasattr(connection, "_connection_retries"):
+            del connection._connection_retries
+
+    def test_jitter_strategies_stay_in_bounds(self) -> None:
+        from django_dbconn_retry import backoff
+        for attempt in range(1, 6):
+            ceiling = 2.0 ** (attempt - 1)
+            self.assertTrue(0 <= backoff.full_jitter(attempt, 1.0, 2.0, 0) <= ceiling)
+            self.assertTrue(ceiling / 2 <= backoff.equal_jitter(attempt, 1.0, 2.0, 0) <= ceiling)
+            self.assertTrue(1.0 <= backoff.decorrelated_jitter(attempt, 1.0, 2.0, ceiling) <= ceiling * 3)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=4, DBCONN_RETRY_DELAY=1.0, DBCONN_RETRY_BACKOFF=10,
+                       DBCONN_RETRY_MAX_DELAY=5)
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_max_delay_caps_backoff(self, mock_sleep: Mock) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1.0, 5, 5, 5])
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=3, DBCONN_RETRY_DELAY=1.0,
+                       DBCONN_RETRY_STRATEGY="django_dbconn_retry.tests.constant_backoff")
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_strategy_by_dotted_path(self, mock_sleep: Mock) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [0.25, 0.25, 0.25])
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=3, DBCONN_RETRY_DELAY=1.0, DBCONN_RETRY_STRATEGY="no.such.strategy")
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_invalid_strategy_falls_back_to_exponential(self, mock_sleep: Mock) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10, DBCONN_RETRY_DELAY=1.0, DBCONN_RETRY_BACKOFF=2,
+                       DBCONN_RETRY_DEADLINE=5)
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_deadline_stops_retrying(self, mock_sleep: Mock) -> None:
+        # time.sleep is mocked, so the clock doesn't advance and only the fourth delay of 8 seconds
+        # would overshoot the deadline.
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1.0, 2.0, 4.0])
+
+
+async def reconnecting_view(request: HttpRequest) -> HttpResponse:
+    await ddr.aensure_connection()
+    return HttpResponse("connected")
+
+
+async def ping_view(request: HttpRequest) -> HttpResponse:
+    # needs the thread-sensitive executor that the async ORM uses, too
+    await sync_to_async(lambda: None)()
+    return HttpResponse("pong")
+
+
+urlpatterns = [
+    path("reconnect/", reconnecting_view),
+    path("ping/", ping_view),
+    path("metrics/", ddr_views.metrics),
+]
+
+
+@override_settings(ROOT_URLCONF="django_dbconn_retry.tests")
+class AsyncRetryTests(TransactionTestCase):
+    """
+    Tests for the non-blocking retry path used from async views.
+    """
+
+    def setUp(self) -> None:
+        connection.close()
+        self.s_connect = BaseDatabaseWrapper.connect
+
+    def tearDown(self) -> None:
+        BaseDatabaseWrapper.connect = self.s_connect
+        connection.close()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=3, DBCONN_RETRY_DELAY=0.2)
+    async def test_other_requests_are_served_during_retry_window(self) -> None:
+        BaseDatabaseWrapper.connect = Mock(side_effect=[OperationalError('async testing')] * 2 + [None])
+        finished = {}  # type: Dict[str, float]
+
+        async def fetch(url: str, wait: float) -> None:
+            await asyncio.sleep(wait)
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            finished[url] = time.monotonic()
+
+        started = time.monotonic()
+        await asyncio.gather(fetch("/reconnect/", 0), fetch("/ping/", 0.05), fetch("/ping/", 0.25))
+        # the reconnecting request waits 0.4 seconds in total, the ping requests must not wait for it
+        self.assertGreaterEqual(finished["/reconnect/"] - started, 0.4)
+        self.assertLess(finished["/ping/"] - started, 0.4)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 3)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2)
+    async def test_signals_and_exhaustion(self) -> None:
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('async testing'))
+        pre_cb = Mock(name='pre_reconnect_hook')
+        post_cb = Mock(name='post_reconnect_hook')
+        ddr.pre_reconnect.connect(pre_cb)
+        ddr.post_reconnect.connect(post_cb)
+        try:
+            with self.assertRaises(OperationalError):
+                await ddr.aensure_connection()
+        finally:
+            ddr.pre_reconnect.disconnect(pre_cb)
+            ddr.post_reconnect.disconnect(post_cb)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 3)
+        self.assertEqual(pre_cb.call_count, 2)
+        self.assertEqual(post_cb.call_count, 1)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=1)
+    async def test_signals_get_the_connected_wrapper(self) -> None:
+        BaseDatabaseWrapper.connect = Mock(side_effect=[OperationalError('async testing'), None])
+        dbwrappers = []  # type: List[Tuple[BaseDatabaseWrapper, BaseDatabaseWrapper]]
+
+        def record_dbwrapper(sender: type, dbwrapper: BaseDatabaseWrapper, **kwargs: Any) -> None:
+            # receivers run in the thread-sensitive executor, like the connection attempts
+            dbwrappers.append((dbwrapper, connections["default"]))
+
+        for signal in (ddr.pre_reconnect, ddr.post_reconnect, ddr.connection_established):
+            signal.connect(record_dbwrapper)
+        try:
+            await ddr.aensure_connection()
+        finally:
+            for signal in (ddr.pre_reconnect, ddr.post_reconnect, ddr.connection_established):
+                signal.disconnect(record_dbwrapper)
+        self.assertEqual(len(dbwrappers), 3)
+        for dbwrapper, connected in dbwrappers:
+            self.assertIs(dbwrapper, connected)
+
+    async def test_non_operational_error_propagates(self) -> None:
+        BaseDatabaseWrapper.connect = Mock(side_effect=ValueError('not a db error'))
+        with self.assertRaises(ValueError):
+            await ddr.aensure_connection()
+        BaseDatabaseWrapper.connect.assert_called_once()
+
+
+class CircuitBreakerTests(TestCase):
+    """
+    Tests for the per-alias circuit breaker.
+    """
+
+    def setUp(self) -> None:
+        reset_breakers()
+        self.s_connect = BaseDatabaseWrapper.connect
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('breaker testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+        self.transitions = []  # type: List[Tuple[str, str]]
+        ddr.breaker_state_changed.connect(self.record_transition)
+
+    def tearDown(self) -> None:
+        ddr.breaker_state_changed.disconnect(self.record_transition)
+        BaseDatabaseWrapper.connect = self.s_connect
+        del BaseDatabaseWrapper.connection
+        if hasattr(connection, "_connection_retries"):
+            del connection._connection_retries
+        reset_breakers()
+
+    def record_transition(self, sender: type, *, alias: str, old_state: str, new_state: str, **kwargs: Any) -> None:
+        self.transitions.append((old_state, new_state))
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10, DBCONN_RETRY_BREAKER_THRESHOLD=3)
+    def test_breaker_opens_and_fails_fast(self) -> None:
+        self.assertRaises(ddr.CircuitOpenError, connection.ensure_connection)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 3)
+        del connection._connection_retries
+        # further calls don't even try to connect
+        self.assertRaises(ddr.CircuitOpenError, connection.ensure_connection)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 3)
+        self.assertEqual(self.transitions, [(CLOSED, OPEN)])
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10, DBCONN_RETRY_BREAKER_THRESHOLD=1, DBCONN_RETRY_BREAKER_COOLDOWN=0.05)
+    def test_probe_after_cooldown_closes_breaker(self) -> None:
+        self.assertRaises(ddr.CircuitOpenError, connection.ensure_connection)
+        del connection._connection_retries
+        time.sleep(0.06)
+        BaseDatabaseWrapper.connect = Mock()
+        connection.ensure_connection()
+        BaseDatabaseWrapper.connect.assert_called_once()
+        self.assertEqual(self.transitions, [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10, DBCONN_RETRY_BREAKER_THRESHOLD=1, DBCONN_RETRY_BREAKER_COOLDOWN=0.05)
+    def test_failed_probe_reopens_breaker(self) -> None:
+        self.assertRaises(ddr.CircuitOpenError, connection.ensure_connection)
+        del connection._connection_retries
+        time.sleep(0.06)
+        # only the probe attempt is made
+        self.assertRaises(ddr.CircuitOpenError, connection.ensure_connection)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 2)
+        self.assertEqual(self.transitions, [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN)])
+
+    def test_only_one_probe_in_half_open_state(self) -> None:
+        breaker = CircuitBreaker("default", threshold=1, cooldown=60)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        # pretend the cool-down has passed
+        with breaker.store.locked() as st:
+            st.changed_at -= 120
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=3)
+    def test_breaker_disabled_by_default(self) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 4)
+        self.assertEqual(self.transitions, [])
+
+
+def _open_shared_breaker(path: str) -> None:
+    breaker = CircuitBreaker("default", threshold=2, cooldown=60, store=SharedBreakerState(path))
+    breaker.record_failure()
+    breaker.record_failure()
+
+
+def _probe_shared_breaker(path: str, results: Any) -> None:
+    breaker = CircuitBreaker("default", threshold=1, cooldown=60, store=SharedBreakerState(path))
+    results.put(breaker.allow())
+
+
+class SharedCircuitBreakerTests(TestCase):
+    """
+    Tests for sharing circuit breaker state between processes.
+    """
+
+    def setUp(self) -> None:
+        reset_breakers()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "default.breaker")
+        self.mp = multiprocessing.get_context("fork")
+
+    def tearDown(self) -> None:
+        reset_breakers()
+        self.tmpdir.cleanup()
+
+    def run_processes(self, target: Callable[..., None], *args: Any, count: int = 1) -> None:
+        processes = [self.mp.Process(target=target, args=args) for _ in range(count)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(10)
+            self.assertEqual(p.exitcode, 0)
+
+    def test_breaker_opened_by_other_process(self) -> None:
+        self.run_processes(_open_shared_breaker, self.path)
+        breaker = CircuitBreaker("default", threshold=2, cooldown=60, store=SharedBreakerState(self.path))
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.store.close()
+
+    def test_single_probe_across_processes(self) -> None:
+        store = SharedBreakerState(self.path)
+        breaker = CircuitBreaker("default", threshold=1, cooldown=60, store=store)
+        breaker.record_failure()
+        # pretend the cool-down has passed
+        with store.locked() as st:
+            st.changed_at -= 120
+        results = self.mp.Queue()
+        self.run_processes(_probe_shared_breaker, self.path, results, count=8)
+        allowed = [results.get(timeout=10) for _ in range(8)]
+        self.assertEqual(allowed.count(True), 1)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        store.close()
+
+    def test_ensure_connection_uses_shared_state(self) -> None:
+        self.run_processes(_open_shared_breaker, self.path)
+        s_connect = BaseDatabaseWrapper.connect
+        mock_connect = BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('shared breaker testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+        try:
+            with override_settings(DBCONN_RETRY_BREAKER_THRESHOLD=2,
+                                   DBCONN_RETRY_BREAKER_SHARED_DIR=self.tmpdir.name):
+                self.assertRaises(ddr.CircuitOpenError, connection.ensure_connection)
+        finally:
+            BaseDatabaseWrapper.connect = s_connect
+            del BaseDatabaseWrapper.connection
+        mock_connect.assert_not_called()
+
+
+@override_settings(ROOT_URLCONF="django_dbconn_retry.tests")
+class MetricsTests(TestCase):
+    """
+    Tests for the connection metrics and their Prometheus rendering.
+    """
+
+    def setUp(self) -> None:
+        reset_stats()
+        self.s_connect = BaseDatabaseWrapper.connect
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('metrics testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+
+    def tearDown(self) -> None:
+        BaseDatabaseWrapper.connect = self.s_connect
+        del BaseDatabaseWrapper.connection
+        if hasattr(connection, "_connection_retries"):
+            del connection._connection_retries
+        reset_stats()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2, DBCONN_RETRY_DELAY=0.5)
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_failed_attempts_are_recorded(self, mock_sleep: Mock) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        stats = ddr.stats()["default"]
+        self.assertEqual(stats["attempts"], 3)
+        self.assertEqual(stats["failures"], {"django.db.utils.OperationalError": 3})
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["sleep_seconds"], 1.0)
+        self.assertEqual(stats["connect_latency"]["count"], 3)
+        self.assertEqual(stats["connect_latency"]["buckets"][-1], (float("inf"), 3))
+
+    def test_successful_attempt_is_recorded(self) -> None:
+        BaseDatabaseWrapper.connect = Mock()
+        connection.ensure_connection()
+        stats = ddr.stats()["default"]
+        self.assertEqual(stats["attempts"], 1)
+        self.assertEqual(stats["failures"], {})
+        self.assertEqual(stats["retries"], 0)
+
+    @override_settings(DBCONN_RETRY_METRICS=False)
+    def test_metrics_can_be_disabled(self) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual(ddr.stats(), {})
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=1)
+    def test_prometheus_view(self) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        del BaseDatabaseWrapper.connection
+        try:
+            response = self.client.get("/metrics/")
+        finally:
+            BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode("utf-8")
+        self.assertIn('dbconn_retry_connect_attempts_total{alias="default"} 2', body)
+        self.assertIn('dbconn_retry_connect_failures_total{alias="default",error="django.db.utils.OperationalError"} 2',
+                      body)
+        self.assertIn('dbconn_retry_connect_latency_seconds_bucket{alias="default",le="+Inf"} 2', body)
+
+
+class SignalPayloadTests(TestCase):
+    """
+    Tests for the attempt and timing information sent with the signals.
+    """
+
+    def setUp(self) -> None:
+        self.s_connect = BaseDatabaseWrapper.connect
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('payload testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+        self.pre_cb = Mock(name='pre_reconnect_hook')
+        self.post_cb = Mock(name='post_reconnect_hook')
+        self.established_cb = Mock(name='connection_established_hook')
+        ddr.pre_reconnect.connect(self.pre_cb)
+        ddr.post_reconnect.connect(self.post_cb)
+        ddr.connection_established.connect(self.established_cb)
+
+    def tearDown(self) -> None:
+        ddr.pre_reconnect.disconnect(self.pre_cb)
+        ddr.post_reconnect.disconnect(self.post_cb)
+        ddr.connection_established.disconnect(self.established_cb)
+        BaseDatabaseWrapper.connect = self.s_connect
+        del BaseDatabaseWrapper.connection
+        if hasattr(connection, "_connection_retries"):
+            del connection._connection_retries
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2, DBCONN_RETRY_DELAY=1.0, DBCONN_RETRY_BACKOFF=2.0)
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_retry_payloads(self, mock_sleep: Mock) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual([c.kwargs["attempt"] for c in self.pre_cb.call_args_list], [1, 2])
+        self.assertEqual([c.kwargs["backoff_time"] for c in self.pre_cb.call_args_list], [1.0, 3.0])
+        self.assertIsInstance(self.pre_cb.call_args.kwargs["exception"], OperationalError)
+        post = self.post_cb.call_args.kwargs
+        self.assertEqual(post["attempt"], 2)
+        self.assertEqual(post["backoff_time"], 3.0)
+        self.assertIsInstance(post["exception"], OperationalError)
+        self.assertGreaterEqual(post["elapsed"], 0)
+        self.established_cb.assert_not_called()
+
+    def test_connection_established_on_first_try(self) -> None:
+        BaseDatabaseWrapper.connect = Mock()
+        connection.ensure_connection()
+        kwargs = self.established_cb.call_args.kwargs
+        self.assertIs(kwargs["dbwrapper"], connections["default"])
+        self.assertEqual(kwargs["attempt"], 0)
+        self.assertEqual(kwargs["backoff_time"], 0.0)
+        self.assertGreaterEqual(kwargs["elapsed"], 0)
+        self.pre_cb.assert_not_called()
+        self.post_cb.assert_not_called()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=5)
+    def test_connection_established_after_retries(self) -> None:
+        BaseDatabaseWrapper.connect = Mock(side_effect=[OperationalError('payload testing')] * 2 + [None])
+        connection.ensure_connection()
+        self.assertEqual(self.established_cb.call_args.kwargs["attempt"], 2)
+        self.assertIsNone(self.post_cb.call_args.kwargs["exception"])
+
+    def test_no_dispatch_without_receivers(self) -> None:
+        ddr.connection_established.disconnect(self.established_cb)
+        BaseDatabaseWrapper.connect = Mock()
+        with patch.object(ddr.connection_established, "send") as send:
+            connection.ensure_connection()
+        send.assert_not_called()
+
+
+class IterativeRetryTests(TestCase):
+    """
+    Tests that retrying doesn't recurse through ensure_connection().
+    """
+
+    def setUp(self) -> None:
+        self.s_connect = BaseDatabaseWrapper.connect
+        BaseDatabaseWrapper.connect = Mock(side_effect=OperationalError('iteration testing'))
+        BaseDatabaseWrapper.connection = property(lambda x: None, lambda x, y: None)  # type: ignore
+
+    def tearDown(self) -> None:
+        BaseDatabaseWrapper.connect = self.s_connect
+        del BaseDatabaseWrapper.connection
+        if hasattr(connection, "_connection_retries"):
+            del connection._connection_retries
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10000)
+    def test_many_retries_dont_hit_recursion_limit(self) -> None:
+        self.assertGreater(10000, sys.getrecursionlimit())
+        with self.assertLogs("django_dbconn_retry", logging.INFO):
+            self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertEqual(BaseDatabaseWrapper.connect.call_count, 10001)
+        self.assertEqual(connection._connection_retries, 10000)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=5)
+    def test_signal_pairing_on_success(self) -> None:
+        BaseDatabaseWrapper.connect = Mock(side_effect=[OperationalError('iteration testing')] * 3 + [None])
+        pre_cb = Mock(name='pre_reconnect_hook')
+        post_cb = Mock(name='post_reconnect_hook')
+        ddr.pre_reconnect.connect(pre_cb)
+        ddr.post_reconnect.connect(post_cb)
+        try:
+            connection.ensure_connection()
+        finally:
+            ddr.pre_reconnect.disconnect(pre_cb)
+            ddr.post_reconnect.disconnect(post_cb)
+        self.assertEqual([c.kwargs["attempt"] for c in pre_cb.call_args_list], [1, 2, 3])
+        self.assertEqual([c.kwargs["attempt"] for c in post_cb.call_args_list], [3, 2, 1])
+        self.assertEqual(connection._connection_retries, 0)
+
+    def test_in_connecting_flag_is_cleared(self) -> None:
+        self.assertRaises(OperationalError, connection.ensure_connection)
+        self.assertFalse(hasattr(connection, "_in_connecting"))
+
+
+class FakeSocketConnection:
+    """
+    A stand-in for a driver connection that exposes its socket like psycopg does.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.closed = False
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+        self.sock.close()
+
+
+class LivenessCheckTests(TestCase):
+    """
+    Tests for the cached, round-trip free liveness check of established connections.
+    """
+
+    def setUp(self) -> None:
+        self.client_sock, self.server_sock = socket.socketpair()
+        self.raw = FakeSocketConnection(self.client_sock)
+        self.dbwrapper = connections.create_connection("default")
+        self.dbwrapper.connection = self.raw
+        self.dbwrapper.autocommit = True
+        self.dbwrapper.connect = Mock()  # type: ignore
+
+    def tearDown(self) -> None:
+        self.client_sock.close()
+        self.server_sock.close()
+
+    def test_connection_is_alive(self) -> None:
+        self.assertTrue(connection_is_alive(self.raw, "postgresql"))
+        self.server_sock.send(b"A")  # a notification is fine
+        self.assertTrue(connection_is_alive(self.raw, "postgresql"))
+
+    def test_server_termination_is_detected(self) -> None:
+        self.server_sock.send(b"E")
+        self.assertFalse(connection_is_alive(self.raw, "postgresql"))
+
+    def test_eof_is_detected(self) -> None:
+        self.server_sock.close()
+        self.assertFalse(connection_is_alive(self.raw, "mysql"))
+
+    def test_any_data_over_tls_is_a_termination(self) -> None:
+        self.raw.info = Mock(ssl_in_use=True, spec=["ssl_in_use"])  # type: ignore
+        self.assertTrue(connection_is_alive(self.raw, "postgresql"))
+        # the header of a TLS application data record, which might hide a following EOF
+        self.server_sock.send(b"\x17")
+        self.assertFalse(connection_is_alive(self.raw, "postgresql"))
+
+    def test_connections_without_socket_are_alive(self) -> None:
+        self.assertTrue(connection_is_alive(object(), "sqlite"))
+
+    def test_high_file_descriptors(self) -> None:
+        # busy processes hand out descriptors above select()'s FD_SETSIZE of 1024
+        try:
+            fd = os.dup2(self.client_sock.fileno(), 1500)
+        except OSError:
+            self.skipTest("can't open file descriptor 1500")
+        high_sock = socket.socket(fileno=fd)
+        try:
+            raw = FakeSocketConnection(high_sock)
+            self.assertTrue(connection_is_alive(raw, "postgresql"))
+            self.server_sock.close()
+            self.assertFalse(connection_is_alive(raw, "postgresql"))
+        finally:
+            high_sock.close()
+
+    @override_settings(DBCONN_RETRY_LIVENESS_INTERVAL=0)
+    def test_stale_connection_is_replaced(self) -> None:
+        self.server_sock.close()
+        self.dbwrapper.ensure_connection()
+        self.dbwrapper.connect.assert_called_once()
+        self.assertTrue(self.raw.closed)
+
+    @override_settings(DBCONN_RETRY_LIVENESS_INTERVAL=60)
+    def test_liveness_is_cached(self) -> None:
+        self.dbwrapper.ensure_connection()
+        self.server_sock.close()
+        self.dbwrapper.ensure_connection()
+        self.dbwrapper.connect.assert_not_called()
+        self.assertIs(self.dbwrapper.connection, self.raw)
+
+    def test_disabled_by_default(self) -> None:
+        self.server_sock.close()
+        self.dbwrapper.ensure_connection()
+        self.dbwrapper.connect.assert_not_called()
+
+    @override_settings(DBCONN_RETRY_LIVENESS_INTERVAL=0)
+    def test_not_replaced_in_transaction(self) -> None:
+        self.dbwrapper.autocommit = False
+        self.server_sock.close()
+        self.dbwrapper.ensure_connection()
+        self.dbwrapper.connect.assert_not_called()
+
+
+class BreakConnection:
+    """
+    An execute wrapper that fails the first ``times`` statements like a connection that was dropped by the server.
+    """
+
+    def __init__(self, times: int = 1, error: type = InterfaceError,
+                 on_break: Optional[Callable[[], None]] = None) -> None:
+        self.times = times
+        self.error = error
+        self.on_break = on_break
+        self.statements = []  # type: List[str]
+
+    def __call__(self, execute: Callable[..., Any], sql: str, params: Any, many: bool,
+                 context: Dict[str, Any]) -> Any:
+        self.statements.append(sql)
+        if self.times > 0:
+            self.times -= 1
+            if self.on_break is not None:
+                self.on_break()
+            raise self.error("connection already closed")
+        return execute(sql, params, many, context)
+
+
+class ClosedFlagConnection:
+    """
+    Proxies a driver connection and, like psycopg2, exposes whether it was closed through ``closed``.
+    """
+
+    def __init__(self, raw: Any) -> None:
+        self._raw = raw
+        self.closed = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+
+class QueryRetryTests(TestCase):
+    """
+    Tests for re-running statements after the connection broke while executing them.
+    """
+
+    def setUp(self) -> None:
+        clear_policies()
+        reset_stats()
+        self.dbwrapper = connections.create_connection("default")
+        self.dbwrapper.ensure_connection()
+        self.raw = self.dbwrapper.connection
+        self.breaker = BreakConnection()
+
+    def tearDown(self) -> None:
+        self.dbwrapper.close()
+        clear_policies()
+        reset_stats()
+
+    def execute(self, sql: str, params: Any = None) -> Any:
+        with self.dbwrapper.execute_wrapper(QueryRetry()), self.dbwrapper.execute_wrapper(self.breaker):
+            with self.dbwrapper.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    def test_select_is_rerun(self) -> None:
+        pre_handler = Mock()
+        post_handler = Mock()
+        ddr.pre_reconnect.connect(pre_handler)
+        ddr.post_reconnect.connect(post_handler)
+        try:
+            self.assertEqual(self.execute("SELECT 1"), [(1,)])
+        finally:
+            ddr.pre_reconnect.disconnect(pre_handler)
+            ddr.post_reconnect.disconnect(post_handler)
+        self.assertEqual(len(self.breaker.statements), 2)
+        self.assertIsNot(self.dbwrapper.connection, self.raw)
+        self.assertEqual(pre_handler.call_args[1]["attempt"], 1)
+        self.assertIsInstance(pre_handler.call_args[1]["exception"], InterfaceError)
+        self.assertIsNone(post_handler.call_args[1]["exception"])
+        self.assertEqual(ddr.stats()["default"]["query_retries"], 1)
+
+    def test_retries_are_limited(self) -> None:
+        self.breaker.times = 3
+        with self.assertRaises(InterfaceError):
+            self.execute("SELECT 1")
+        # MAX_DBCONN_RETRY_TIMES=1 by default
+        self.assertEqual(len(self.breaker.statements), 2)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=0)
+    def test_disabled_by_max_retries(self) -> None:
+        with self.assertRaises(InterfaceError):
+            self.execute("SELECT 1")
+        self.assertEqual(len(self.breaker.statements), 1)
+
+    def not_a_select(self) -> str:
+        # a statement that QueryRetry doesn't consider read-only, but that has no side effects on any backend
+        return "VALUES ROW(1)" if self.dbwrapper.vendor == "mysql" else "VALUES (1)"
+
+    def test_writes_are_not_rerun(self) -> None:
+        with self.assertRaises(InterfaceError):
+            self.execute(self.not_a_select())
+        self.assertEqual(len(self.breaker.statements), 1)
+
+    def test_idempotent_statements_are_rerun(self) -> None:
+        with idempotent():
+            self.assertEqual(self.execute(self.not_a_select()), [(1,)])
+        self.assertEqual(len(self.breaker.statements), 2)
+
+    def test_not_rerun_in_atomic_block(self) -> None:
+        # transaction.atomic() only works on the shared connection objects
+        self.dbwrapper.in_atomic_block = True
+        try:
+            with self.assertRaises(InterfaceError):
+                self.execute("SELECT 1")
+        finally:
+            self.dbwrapper.in_atomic_block = False
+        self.assertEqual(len(self.breaker.statements), 1)
+
+    def _drop_like_psycopg2(self) -> ClosedFlagConnection:
+        proxy = ClosedFlagConnection(self.raw)
+        self.dbwrapper.connection = proxy
+
+        def drop() -> None:
+            # psycopg2 raises an OperationalError and marks the connection as closed
+            proxy.closed = 2
+
+        self.breaker = BreakConnection(error=OperationalError, on_break=drop)
+        return proxy
+
+    def test_dropped_connection_marked_closed_is_rerun(self) -> None:
+        proxy = self._drop_like_psycopg2()
+        self.assertEqual(self.execute("SELECT 1"), [(1,)])
+        self.assertEqual(len(self.breaker.statements), 2)
+        self.assertIsNot(self.dbwrapper.connection, proxy)
+
+    def test_failing_to_close_dropped_connection(self) -> None:
+        proxy = self._drop_like_psycopg2()
+        proxy.close = Mock(  # type: ignore
+            side_effect=self.dbwrapper.Database.InterfaceError("connection already closed"))
+        try:
+            self.assertEqual(self.execute("SELECT 1"), [(1,)])
+        finally:
+            self.raw.close()
+        proxy.close.assert_called_once()
+        self.assertIsNot(self.dbwrapper.connection, proxy)
+
+    def test_dropped_connection_marked_closed_is_kept_for_writes(self) -> None:
+        proxy = self._drop_like_psycopg2()
+        with self.assertRaises(OperationalError):
+            self.execute(self.not_a_select())
+        self.assertEqual(len(self.breaker.statements), 1)
+        # deciding not to retry must not reconnect either
+        self.assertIs(self.dbwrapper.connection, proxy)
+
+    def test_errors_on_live_connections_are_not_rerun(self) -> None:
+        # sqlite connections are always alive, so this is a statement error like a timeout
+        self.breaker.error = OperationalError
+        with self.assertRaises(OperationalError):
+            self.execute("SELECT 1")
+        self.assertEqual(len(self.breaker.statements), 1)
+        self.assertIs(self.dbwrapper.connection, self.raw)
+
+    def test_retry_queries(self) -> None:
+        with retry_queries(using=[self.dbwrapper.alias]):
+            self.assertEqual(len(connections[self.dbwrapper.alias].execute_wrappers), 1)
+            self.assertIsInstance(connections[self.dbwrapper.alias].execute_wrappers[0], QueryRetry)
+        self.assertEqual(connections[self.dbwrapper.alias].execute_wrappers, [])
+
+    def test_middleware(self) -> None:
+        wrappers = []  # type: List[Any]
+        middleware = QueryRetryMiddleware(lambda request: wrappers.extend(connection.execute_wrappers) or
+                                          HttpResponse())
+        middleware(HttpRequest())
+        self.assertTrue(any(isinstance(wrapper, QueryRetry) for wrapper in wrappers))
+        self.assertFalse(any(isinstance(wrapper, QueryRetry) for wrapper in connection.execute_wrappers))
+
+
+class FailoverRouterTestRouter(FailoverRouter):
+    read_database = "replica1"
+
+
+class FailoverTests(TestCase):
+    """
+    Tests for the health registry and the failover of reads to other aliases.
+    """
+
+    def setUp(self) -> None:
+        reset_health()
+        reset_breakers()
+        self.databases_patch = patch.dict(settings.DATABASES, {
+            "replica1": dict(settings.DATABASES["default"], DBCONN_RETRY={
+                "DBCONN_RETRY_FAILOVER": ["replica2", "default"],
+            }),
+            "replica2": dict(settings.DATABASES["default"]),
+        })
+        self.databases_patch.start()
+        clear_policies()
+
+    def tearDown(self) -> None:
+        self.databases_patch.stop()
+        clear_policies()
+        reset_health()
+        reset_breakers()
+
+    def test_failover_chain_in_policy(self) -> None:
+        self.assertEqual(ddr.get_retry_policy("replica1").failover, ("replica2", "default"))
+        self.assertEqual(ddr.get_retry_policy("replica2").failover, ())
+
+    def test_unknown_aliases_are_ignored(self) -> None:
+        settings.DATABASES["replica2"]["DBCONN_RETRY"] = {"DBCONN_RETRY_FAILOVER": ["replica2", "nope", "default"]}
+        with self.assertLogs("django_dbconn_retry.policy", logging.WARNING):
+            self.assertEqual(ddr.get_retry_policy("replica2").failover, ("default",))
+
+    def test_select_alias(self) -> None:
+        self.assertEqual(select_alias("replica1"), "replica1")
+        mark_down("replica1", 60)
+        self.assertEqual(select_alias("replica1"), "replica2")
+        mark_down("replica2", 60)
+        self.assertEqual(select_alias("replica1"), "default")
+        mark_down("default", 60)
+        # nothing is healthy, so the normal retry logic takes over
+        self.assertEqual(select_alias("replica1"), "replica1")
+        mark_up("replica2")
+        self.assertEqual(select_alias("replica1"), "replica2")
+
+    def test_down_expires(self) -> None:
+        mark_down("replica1", 0)
+        self.assertTrue(is_healthy("replica1"))
+
+    @override_settings(DBCONN_RETRY_BREAKER_THRESHOLD=1)
+    def test_open_breaker_is_unhealthy(self) -> None:
+        policy = ddr.get_retry_policy("replica1")
+        breaker = get_breaker("replica1", policy.breaker_threshold, policy.breaker_cooldown)
+        breaker.record_failure()
+        self.assertFalse(is_healthy("replica1"))
+        self.assertEqual(select_alias("replica1"), "replica2")
+
+    def test_router(self) -> None:
+        router = FailoverRouterTestRouter()
+        self.assertEqual(router.db_for_read(Mock()), "replica1")
+        mark_down("replica1", 60)
+        self.assertEqual(router.db_for_read(Mock()), "replica2")
+
+    def test_exhausted_retries_mark_alias_down(self) -> None:
+        dbwrapper = connections.create_connection("replica1")
+        dbwrapper.connect = Mock(side_effect=OperationalError("failover testing"))  # type: ignore
+        # the test runner forbids connections to aliases outside of `databases` through ensure_connection()
+        self.assertRaises(OperationalError, ensure_connection_with_retries, dbwrapper)
+        self.assertFalse(is_healthy("replica1"))
+        self.assertEqual(select_alias("replica1"), "replica2")
+
+        dbwrapper.connect = Mock()  # type: ignore
+        ensure_connection_with_retries(dbwrapper)
+        self.assertTrue(is_healthy("replica1"))
+
+
+class WarmupTests(TransactionTestCase):
+    """
+    Tests for connecting to all databases at worker startup.
+    """
+
+    def setUp(self) -> None:
+        connection.close()
+        if hasattr(connection, "_connection_retries"):
+            del connection._connection_retries
+
+    def test_warm_up_connects_in_pool_thread(self) -> None:
+        threads = []  # type: List[str]
+
+        def record_thread(sender: type, **kwargs: Any) -> None:
+            threads.append(threading.current_thread().name)
+
+        ddr.connection_established.connect(record_thread)
+        try:
+            results = warm_up()
+        finally:
+            ddr.connection_established.disconnect(record_thread)
+        self.assertEqual(list(results), ["default"])
+        self.assertTrue(results["default"].ok)
+        self.assertGreater(results["default"].elapsed, 0)
+        self.assertTrue(threads[0].startswith("dbconn-warmup"))
+        # the connection is handed back to this thread
+        self.assertIsNotNone(connection.connection)
+        self.assertTrue(connection.is_usable())
+        connection.validate_thread_sharing()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=0)
+    def test_warm_up_reports_failures(self) -> None:
+        with patch.object(connections["default"], "connect", side_effect=OperationalError("warmup testing")) \
+                as connect:
+            results = warm_up(["default"])
+        connect.assert_called_once()
+        self.assertFalse(results["default"].ok)
+        self.assertIsInstance(results["default"].error, OperationalError)
+
+    def test_gunicorn_hooks(self) -> None:
+        post_worker_init(Mock())
+        self.assertTrue(connection.is_usable())
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=0)
+    def test_gunicorn_hooks_fail_worker(self) -> None:
+        for call_hook in (lambda: post_fork(Mock(), Mock()), lambda: post_worker_init(Mock())):
+            with patch.object(connections["default"], "connect", side_effect=OperationalError("warmup testing")):
+                with self.assertRaisesMessage(OperationalError, "Couldn't connect to default."):
+                    call_hook()
+
+    def test_command(self) -> None:
+        stdout = io.StringIO()
+        call_command("dbconn_warmup", "--database", "default", stdout=stdout)
+        self.assertIn("default: connected in", stdout.getvalue())
+
+    def test_command_fails(self) -> None:
+        with patch("django_dbconn_retry.management.commands.dbconn_warmup.warm_up",
+                   return_value={"default": WarmupResult("default", 0.1, OperationalError("down"))}):
+            with self.assertRaises(CommandError):
+                call_command("dbconn_warmup", stderr=io.StringIO())
+
+
+@override_settings(DBCONN_RETRY_POOL_SIZE=2)
+class ConnectionPoolTests(TestCase):
+    """
+    Tests for reusing driver connections across requests.
+    """
+
+    def setUp(self) -> None:
+        reset_pools()
+        self.dbwrappers = []  # type: List[BaseDatabaseWrapper]
+
+    def tearDown(self) -> None:
+        for dbwrapper in self.dbwrappers:
+            dbwrapper.close()
+        reset_pools()
+
+    def connect(self) -> BaseDatabaseWrapper:
+        dbwrapper = connections.create_connection("default")
+        self.dbwrappers.append(dbwrapper)
+        dbwrapper.ensure_connection()
+        return dbwrapper
+
+    def test_connections_are_reused(self) -> None:
+        first = self.connect()
+        raw = first.connection
+        first.close()
+        self.assertIsNone(first.connection)
+
+        second = self.connect()
+        self.assertIs(second.connection, raw)
+        with second.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchone(), (1,))
+        pool = get_pool("default")
+        self.assertEqual((pool.created, pool.reused), (1, 1))
+
+    @override_settings(DBCONN_RETRY_POOL_SIZE=1)
+    def test_pool_is_bounded(self) -> None:
+        first = self.connect()
+        second = self.connect()
+        second_raw = second.connection
+        first.close()
+        second.close()
+        self.assertEqual(len(get_pool("default")), 1)
+        with self.assertRaises(Exception):
+            second_raw.execute("SELECT 1")
+
+    def test_broken_connections_are_evicted(self) -> None:
+        client_sock, server_sock = socket.socketpair()
+        raw = FakeSocketConnection(client_sock)
+        pool = ConnectionPool("default", "postgresql", 2)
+        pool.checkin(raw)
+        self.assertEqual(len(pool), 1)
+        server_sock.close()
+        self.assertEqual(pool.checkout(lambda: "new connection"), "new connection")
+        self.assertTrue(raw.closed)
+        self.assertEqual((pool.created, pool.reused, pool.evicted), (1, 0, 1))
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=0)
+    def test_failed_connect_clears_pool(self) -> None:
+        self.connect().close()
+        self.assertEqual(len(get_pool("default")), 1)
+        dbwrapper = connections.create_connection("default")
+        dbwrapper.connect = Mock(side_effect=OperationalError("pool testing"))  # type: ignore
+        self.assertRaises(OperationalError, dbwrapper.ensure_connection)
+        self.assertEqual(len(get_pool("default")), 0)
+
+    def test_not_returned_from_atomic_block(self) -> None:
+        dbwrapper = self.connect()
+        dbwrapper.in_atomic_block = True
+        try:
+            dbwrapper.close()
+        finally:
+            dbwrapper.in_atomic_block = False
+            dbwrapper.closed_in_transaction = False
+            dbwrapper.connection = None
+        self.assertEqual(len(get_pool("default")), 0)
+
+    def test_pool_can_be_disabled(self) -> None:
+        dbwrapper = self.connect()
+        dbwrapper.close()
+        with override_settings(DBCONN_RETRY_POOL_SIZE=0):
+            dbwrapper.ensure_connection()
+        self.assertNotIn("get_new_connection", dbwrapper.__dict__)
+        self.assertNotIn("_close", dbwrapper.__dict__)
+
+
+class CustomConnectError(Exception):
+    pass
+
+
+class RetryableErrorsTests(TestCase):
+    """
+    Tests for the lazily discovered retryable exception types.
+    """
+
+    def setUp(self) -> None:
+        clear_policies()
+
+    def tearDown(self) -> None:
+        clear_policies()
+
+    def test_backend_errors(self) -> None:
+        errors = get_retryable_errors(connection)
+        self.assertIn(OperationalError, errors)
+        self.assertIn(connection.Database.OperationalError, errors)
+        self.assertNotIn(CustomConnectError, errors)
+
+    @override_settings(DBCONN_RETRY_EXTRA_EXCEPTIONS=["django_dbconn_retry.tests.CustomConnectError"])
+    def test_extra_exceptions(self) -> None:
+        self.assertIn(CustomConnectError, get_retryable_errors(connection))
+        dbwrapper = connections.create_connection("default")
+        dbwrapper.connect = Mock(side_effect=[CustomConnectError("extra testing"), None])  # type: ignore
+        dbwrapper.ensure_connection()
+        self.assertEqual(dbwrapper.connect.call_count, 2)
+
+    @override_settings(DBCONN_RETRY_EXTRA_EXCEPTIONS=["no.such.Error", "django_dbconn_retry.tests.connection"])
+    def test_invalid_extra_exceptions_are_ignored(self) -> None:
+        with self.assertLogs("django_dbconn_retry.policy", logging.WARNING) as logs:
+            self.assertEqual(ddr.get_retry_policy("default").extra_exceptions, ())
+        self.assertEqual(len(logs.records), 2)
+
+    @override_settings(DBCONN_RETRY_EXTRA_EXCEPTIONS=[".tests.CustomConnectError", "."])
+    def test_relative_extra_exceptions_are_ignored(self) -> None:
+        with self.assertLogs("django_dbconn_retry.policy", logging.WARNING) as logs:
+            self.assertEqual(ddr.get_retry_policy("default").extra_exceptions, ())
+        self.assertEqual(len(logs.records), 2)
+
+    def test_extra_exceptions_must_be_a_list(self) -> None:
+        for value in ("django_dbconn_retry.tests.CustomConnectError", CustomConnectError):
+            clear_policies()
+            with self.settings(DBCONN_RETRY_EXTRA_EXCEPTIONS=value):
+                with self.assertLogs("django_dbconn_retry.policy", logging.WARNING) as logs:
+                    self.assertEqual(ddr.get_retry_policy("default").extra_exceptions, ())
+            self.assertIn("Invalid DBCONN_RETRY_EXTRA_EXCEPTIONS setting", logs.output[0])
+
+
+class FakeDriverError(OperationalError):
+    def __init__(self, message: str, pgcode: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.pgcode = pgcode
+
+
+class ErrorClassificationTests(TestCase):
+    """
+    Tests for failing fast on permanent errors and refreshing rejected credentials.
+    """
+
+    def setUp(self) -> None:
+        self.dbwrapper = connections.create_connection("default")
+
+    def test_sqlstates(self) -> None:
+        self.assertEqual(classify_error(FakeDriverError("", "57P01")), TRANSIENT)
+        self.assertEqual(classify_error(FakeDriverError("", "08006")), TRANSIENT)
+        self.assertEqual(classify_error(FakeDriverError("", "28P01")), AUTH)
+        self.assertEqual(classify_error(FakeDriverError("", "3D000")), PERMANENT)
+
+    def test_mysql_errnos(self) -> None:
+        self.assertEqual(classify_error(OperationalError(1045, "Access denied")), AUTH)
+        self.assertEqual(classify_error(OperationalError(1049, "Unknown database 'x'")), PERMANENT)
+        self.assertEqual(classify_error(OperationalError(1040, "Too many connections")), TRANSIENT)
+
+    def test_messages(self) -> None:
+        self.assertEqual(classify_error(sqlite3.OperationalError("unable to open database file")), PERMANENT)
+        self.assertEqual(classify_error(sqlite3.OperationalError("database is locked")), TRANSIENT)
+        self.assertEqual(classify_error(OperationalError(
+            'connection to server failed: FATAL:  password authentication failed for user "x"')), AUTH)
+        self.assertEqual(classify_error(OperationalError('FATAL:  database "x" does not exist')), PERMANENT)
+        self.assertEqual(classify_error(OperationalError("something else")), TRANSIENT)
+
+    def test_wrapped_errors(self) -> None:
+        try:
+            try:
+                raise FakeDriverError("", "3D000")
+            except FakeDriverError as e:
+                raise OperationalError("wrapped") from e
+        except OperationalError as e:
+            self.assertEqual(classify_error(e), PERMANENT)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=5)
+    def test_permanent_errors_fail_fast(self) -> None:
+        post_handler = Mock()
+        ddr.post_reconnect.connect(post_handler)
+        try:
+            self.dbwrapper.connect = Mock(side_effect=FakeDriverError("", "3D000"))  # type: ignore
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+        finally:
+            ddr.post_reconnect.disconnect(post_handler)
+        self.dbwrapper.connect.assert_called_once()
+        # there was no pre_reconnect to answer
+        post_handler.assert_not_called()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=5, DBCONN_RETRY_DELAY=10)
+    def test_auth_errors_are_retried_once_after_refresh(self) -> None:
+        refresh = Mock()
+        ddr.pre_reconnect.connect(refresh)
+        try:
+            self.dbwrapper.connect = Mock(side_effect=FakeDriverError("", "28P01"))  # type: ignore
+            with patch("django_dbconn_retry.apps.time.sleep") as sleep:
+                self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+            self.assertEqual(self.dbwrapper.connect.call_count, 2)
+            refresh.assert_called_once()
+            sleep.assert_not_called()
+
+            self.dbwrapper._connection_retries = 0
+            self.dbwrapper.connect = Mock(side_effect=[FakeDriverError("", "28P01"), None])  # type: ignore
+            self.dbwrapper.ensure_connection()
+            self.assertEqual(self.dbwrapper.connect.call_count, 2)
+        finally:
+            ddr.pre_reconnect.disconnect(refresh)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=0)
+    def test_auth_errors_respect_max_retries(self) -> None:
+        self.dbwrapper.connect = Mock(side_effect=FakeDriverError("", "28P01"))  # type: ignore
+        self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+        self.dbwrapper.connect.assert_called_once()
+
+
+class ConnectLimiterTests(TestCase):
+    """
+    Tests for the adaptive limit on concurrent connection attempts.
+    """
+
+    def setUp(self) -> None:
+        reset_limiters()
+
+    def tearDown(self) -> None:
+        reset_limiters()
+
+    def test_overload_halves_the_limit_once_per_round(self) -> None:
+        limiter = ConnectLimiter("default")
+        tokens = [limiter.acquire() for _ in range(4)]
+        overload = OperationalError("FATAL:  sorry, too many clients already")
+        limiter.release(tokens[0], overload)
+        self.assertEqual(limiter.limit, 2)
+        # these were admitted before the decrease
+        limiter.release(tokens[1], overload)
+        limiter.release(tokens[2], OperationalError("connection refused"))
+        self.assertEqual(limiter.limit, 2)
+        limiter.release(tokens[3])
+        self.assertEqual(limiter.limit, 3)
+        limiter.release(limiter.acquire())
+        # back at the concurrency that overloaded the database
+        self.assertIsNone(limiter.limit)
+
+    def test_reserved_connection_slots_are_an_overload(self) -> None:
+        # what roles without SUPERUSER get at max_connections, psycopg2 doesn't set a pgcode on connect errors
+        for message in (
+            "connection to server at \"localhost\" (127.0.0.1), port 5432 failed: FATAL:  remaining connection "
+            "slots are reserved for non-replication superuser connections\n",
+            "connection to server at \"localhost\" (127.0.0.1), port 5432 failed: FATAL:  remaining connection "
+            "slots are reserved for roles with the SUPERUSER attribute\n",
+        ):
+            error = FakeDriverError(message)
+            self.assertTrue(is_overload(error))
+            self.assertEqual(classify_error(error), TRANSIENT)
+        limiter = ConnectLimiter("default")
+        tokens = [limiter.acquire() for _ in range(2)]
+        limiter.release(tokens[0], FakeDriverError(message))
+        self.assertEqual(limiter.limit, 1)
+        limiter.release(tokens[1])
+
+    def test_ceiling(self) -> None:
+        limiter = get_limiter("default", 2)
+        self.assertEqual(limiter.limit, 2)
+        limiter.release(limiter.acquire(), FakeDriverError("", "53300"))
+        self.assertEqual(limiter.limit, 1)
+        limiter.release(limiter.acquire())
+        limiter.release(limiter.acquire())
+        self.assertEqual(limiter.limit, 2)
+
+    def test_limit_is_enforced(self) -> None:
+        limiter = ConnectLimiter("default", 2)
+        running = []  # type: List[int]
+        concurrency = []  # type: List[int]
+
+        def connect() -> None:
+            token = limiter.acquire()
+            running.append(1)
+            concurrency.append(len(running))
+            time.sleep(0.01)
+            running.pop()
+            limiter.release(token)
+
+        threads = [threading.Thread(target=connect) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(concurrency), 2)
+
+    def test_acquire_times_out(self) -> None:
+        limiter = ConnectLimiter("default", 1)
+        self.assertIsNotNone(limiter.acquire())
+        self.assertIsNone(limiter.acquire(timeout=0.01))
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=0)
+    def test_retry_loop_adapts_the_limit(self) -> None:
+        dbwrapper = connections.create_connection("default")
+        dbwrapper.connect = Mock(side_effect=OperationalError("too many connections"))  # type: ignore
+        self.assertRaises(OperationalError, dbwrapper.ensure_connection)
+        self.assertEqual(ddr.get_connect_limit("default"), 1)
+        dbwrapper.connect = Mock()  # type: ignore
+        dbwrapper.ensure_connection()
+        self.assertIsNone(ddr.get_connect_limit("default"))
+
+    @override_settings(DBCONN_RETRY_DEADLINE=0.01, DBCONN_RETRY_CONNECT_CONCURRENCY=1)
+    def test_waiting_is_limited_by_deadline(self) -> None:
+        get_limiter("default", 1).acquire()
+        dbwrapper = connections.create_connection("default")
+        dbwrapper.connect = Mock()  # type: ignore
+        self.assertRaises(ConnectLimitError, dbwrapper.ensure_connection)
+        dbwrapper.connect.assert_not_called()
+
+
+class RetryStateTests(TestCase):
+    """
+    Tests for the per-connection retry state, in particular that receivers
+    that raise can't leave it behind inconsistently.
+    """
+
+    def setUp(self) -> None:
+        self.dbwrapper = connections.create_connection("default")
+
+    def test_state_has_no_dict(self) -> None:
+        self.assertFalse(hasattr(RetryState(), "__dict__"))
+        self.assertIs(get_state(self.dbwrapper), get_state(self.dbwrapper))
+
+    def test_connection_retries_compat(self) -> None:
+        self.dbwrapper._connection_retries = 3
+        self.assertEqual(get_state(self.dbwrapper).retries, 3)
+        del self.dbwrapper._connection_retries
+        self.assertEqual(self.dbwrapper._connection_retries, 0)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2)
+    def test_raising_pre_reconnect_receiver(self) -> None:
+        def fail(*args: Any, **kwargs: Any) -> None:
+            raise RuntimeError("receiver failed")
+
+        self.dbwrapper.connect = Mock(side_effect=OperationalError("connection refused"))  # type: ignore
+        ddr.pre_reconnect.connect(fail)
+        try:
+            self.assertRaises(RuntimeError, self.dbwrapper.ensure_connection)
+        finally:
+            ddr.pre_reconnect.disconnect(fail)
+        state = get_state(self.dbwrapper)
+        self.assertFalse(state.connecting)
+        self.assertEqual(state.retries, 1)
+        # the next call must not mistake the connection for one that's still being set up
+        self.dbwrapper.connect = Mock()  # type: ignore
+        self.dbwrapper.ensure_connection()
+        self.dbwrapper.connect.assert_called_once_with()
+        self.assertEqual(state.retries, 0)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2)
+    def test_raising_connection_established_receiver(self) -> None:
+        def fail(*args: Any, **kwargs: Any) -> None:
+            raise RuntimeError("receiver failed")
+
+        self.dbwrapper.connect = Mock(side_effect=[OperationalError("connection refused"), None])  # type: ignore
+        ddr.connection_established.connect(fail)
+        try:
+            self.assertRaises(RuntimeError, self.dbwrapper.ensure_connection)
+        finally:
+            ddr.connection_established.disconnect(fail)
+        state = get_state(self.dbwrapper)
+        self.assertFalse(state.connecting)
+        self.assertEqual(state.retries, 0)
+
+    def test_shared_connection_connects_once(self) -> None:
+        raw = Mock()
+
+        def connect() -> None:
+            time.sleep(0.05)
+            self.dbwrapper.connection = raw
+
+        self.dbwrapper.connect = Mock(side_effect=connect)  # type: ignore
+        self.dbwrapper.inc_thread_sharing()
+        try:
+            threads = [threading.Thread(target=self.dbwrapper.ensure_connection) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.dbwrapper.dec_thread_sharing()
+            self.dbwrapper.connection = None
+        self.dbwrapper.connect.assert_called_once_with()
+
+
+class RequestDeadlineTests(TestCase):
+    """
+    Tests for limiting the time spent on retries per request.
+    """
+
+    def setUp(self) -> None:
+        self.dbwrapper = connections.create_connection("default")
+        self.dbwrapper.connect = Mock(side_effect=OperationalError("connection refused"))  # type: ignore
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10, DBCONN_RETRY_DELAY=1.0, DBCONN_RETRY_BACKOFF=2)
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_deadline_stops_retrying(self, mock_sleep: Mock) -> None:
+        # time.sleep is mocked, so the clock doesn't advance and only the fourth delay of 8 seconds
+        # would overshoot the deadline.
+        with ddr.retry_deadline(5):
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1.0, 2.0, 4.0])
+        self.assertEqual(self.dbwrapper.connect.call_count, 4)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=10, DBCONN_RETRY_DELAY=1.0, DBCONN_RETRY_BACKOFF=2,
+                       DBCONN_RETRY_DEADLINE=3)
+    @patch('django_dbconn_retry.apps.time.sleep')
+    def test_earlier_deadline_wins(self, mock_sleep: Mock) -> None:
+        with ddr.retry_deadline(60):
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1.0, 2.0])
+        mock_sleep.reset_mock()
+        del self.dbwrapper._connection_retries
+        with ddr.retry_deadline(1.5):
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1.0])
+
+    @patch('django_dbconn_retry.deadline.time.monotonic', return_value=100.0)
+    def test_nested_deadlines_only_shorten(self, mock_monotonic: Mock) -> None:
+        self.assertIsNone(get_deadline())
+        with ddr.retry_deadline(10):
+            with ddr.retry_deadline(60):
+                self.assertEqual(get_deadline(), 110.0)
+            with ddr.retry_deadline(5):
+                self.assertEqual(get_deadline(), 105.0)
+            self.assertEqual(get_deadline(), 110.0)
+        self.assertIsNone(get_deadline())
+
+    @override_settings(DBCONN_RETRY_REQUEST_TIMEOUT=3)
+    def test_middleware(self) -> None:
+        deadlines = []  # type: List[Optional[float]]
+        middleware = RequestDeadlineMiddleware(lambda request: deadlines.append(get_deadline()) or HttpResponse())
+        before = time.monotonic()
+        middleware(HttpRequest())
+        self.assertIsNotNone(deadlines[0])
+        self.assertAlmostEqual(deadlines[0] - before, 3, delta=1)
+        self.assertIsNone(get_deadline())
+
+    def test_middleware_without_timeout(self) -> None:
+        deadlines = []  # type: List[Optional[float]]
+        middleware = RequestDeadlineMiddleware(lambda request: deadlines.append(get_deadline()) or HttpResponse())
+        middleware(HttpRequest())
+        self.assertEqual(deadlines, [None])
+
+    @override_settings(DBCONN_RETRY_REQUEST_TIMEOUT="9")
+    def test_middleware_with_invalid_timeout(self) -> None:
+        deadlines = []  # type: List[Optional[float]]
+        with self.assertLogs("django_dbconn_retry.deadline", logging.WARNING) as logs:
+            middleware = RequestDeadlineMiddleware(
+                lambda request: deadlines.append(get_deadline()) or HttpResponse())
+        self.assertIn("Invalid DBCONN_RETRY_REQUEST_TIMEOUT setting '9'", logs.output[0])
+        middleware(HttpRequest())
+        self.assertEqual(deadlines, [None])
+
+
+class SingleflightTests(TestCase):
+    """
+    Tests for coordinating reconnects to an alias between threads.
+    """
+
+    def setUp(self) -> None:
+        reset_singleflights()
+
+    def tearDown(self) -> None:
+        reset_singleflights()
+
+    def test_first_thread_leads(self) -> None:
+        singleflight = Singleflight("default")
+        flight, leading = singleflight.join()
+        self.assertTrue(leading)
+        self.assertEqual(singleflight.join(), (flight, False))
+        self.assertFalse(flight.wait(0.01))
+        singleflight.land(flight, True)
+        self.assertTrue(flight.wait(0))
+        self.assertTrue(singleflight.join()[1])
+
+    def _connect_concurrently(self, server_up: threading.Event,
+                              threads: int) -> Tuple[List[threading.Thread], List[Mock]]:
+        def connect() -> None:
+            if not server_up.is_set():
+                raise OperationalError("connection refused")
+
+        wrappers = [connections.create_connection("default") for _ in range(threads)]
+        for dbwrapper in wrappers:
+            dbwrapper.connect = Mock(side_effect=connect)  # type: ignore
+
+        def run(dbwrapper: BaseDatabaseWrapper) -> None:
+            try:
+                dbwrapper.ensure_connection()
+            except OperationalError:
+                pass
+
+        workers = [threading.Thread(target=run, args=(dbwrapper,)) for dbwrapper in wrappers]
+        for worker in workers:
+            worker.start()
+        return workers, [dbwrapper.connect for dbwrapper in wrappers]
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=20, DBCONN_RETRY_DELAY=0.02, DBCONN_RETRY_SINGLEFLIGHT_TIMEOUT=5)
+    def test_followers_wait_for_the_leader(self) -> None:
+        server_up = threading.Event()
+        workers, connects = self._connect_concurrently(server_up, 4)
+        time.sleep(0.1)
+        server_up.set()
+        for worker in workers:
+            worker.join()
+        calls = sorted(connect.call_count for connect in connects)
+        # one failed attempt and one after the leader got through each
+        self.assertEqual(calls[:3], [2, 2, 2])
+        self.assertGreater(calls[3], 2)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2, DBCONN_RETRY_DELAY=0.02, DBCONN_RETRY_SINGLEFLIGHT_TIMEOUT=5)
+    def test_followers_give_up_with_the_leader(self) -> None:
+        workers, connects = self._connect_concurrently(threading.Event(), 4)
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sorted(connect.call_count for connect in connects), [1, 1, 1, 3])
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=3, DBCONN_RETRY_SINGLEFLIGHT_TIMEOUT=0.01)
+    def test_followers_time_out(self) -> None:
+        # another thread is reconnecting, but never finishes
+        get_singleflight("default").join()
+        dbwrapper = connections.create_connection("default")
+        dbwrapper.connect = Mock(side_effect=OperationalError("connection refused"))  # type: ignore
+        started = time.monotonic()
+        self.assertRaises(OperationalError, dbwrapper.ensure_connection)
+        self.assertLess(time.monotonic() - started, 1)
+        dbwrapper.connect.assert_called_once_with()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=3)
+    def test_disabled_by_default(self) -> None:
+        workers, connects = self._connect_concurrently(threading.Event(), 2)
+        for worker in workers:
+            worker.join()
+        self.assertEqual([connect.call_count for connect in connects], [4, 4])
+
+
+class FaultInjectionTests(TestCase):
+    """
+    Tests for the fault injection engine and simulating outages with it.
+    """
+
+    def setUp(self) -> None:
+        reset_faults()
+
+    def tearDown(self) -> None:
+        reset_faults()
+
+    def _settings_dict(self, **faults: Any) -> Dict[str, Any]:
+        settings_dict = dict(connection.settings_dict)
+        settings_dict["WRAPPED_ENGINE"] = settings_dict["ENGINE"]
+        settings_dict["ENGINE"] = "django_dbconn_retry.backends.faultinjection"
+        settings_dict["FAULT_INJECTION"] = faults
+        return settings_dict
+
+    def test_wraps_engine(self) -> None:
+        dbwrapper = FaultInjectionWrapper(self._settings_dict(), "default")
+        self.assertIsInstance(dbwrapper, FaultInjectionMixin)
+        self.assertIsInstance(dbwrapper, type(connections["default"]))
+        self.assertIs(type(FaultInjectionWrapper(self._settings_dict(), "default")), type(dbwrapper))
+        dbwrapper.ensure_connection()
+        dbwrapper.close()
+
+    def test_requires_wrapped_engine(self) -> None:
+        self.assertRaises(ImproperlyConfigured, wrap_engine, dict(connection.settings_dict), FaultInjectionMixin)
+        settings_dict = self._settings_dict()
+        settings_dict["WRAPPED_ENGINE"] = "django_dbconn_retry.backends.faultinjection"
+        self.assertRaises(ImproperlyConfigured, wrap_engine, settings_dict, FaultInjectionMixin)
+
+    def test_outages(self) -> None:
+        faults = Faults(outages=[(10, 5)])
+        self.assertFalse(faults.in_outage())
+        self.assertTrue(faults.in_outage(faults.epoch + 12))
+        self.assertFalse(faults.in_outage(faults.epoch + 15))
+        faults.start_outage(1)
+        self.assertRaises(sqlite3.OperationalError, faults.inject, sqlite3.OperationalError)
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2)
+    def test_failing_connection_attempts_are_retried(self) -> None:
+        attempts = []  # type: List[int]
+
+        def count(sender: Any, attempt: int, **kwargs: Any) -> None:
+            attempts.append(attempt)
+
+        dbwrapper = FaultInjectionWrapper(self._settings_dict(FAILURE_RATE=1.0), "default")
+        ddr.pre_reconnect.connect(count)
+        try:
+            self.assertRaises(OperationalError, dbwrapper.ensure_connection)
+        finally:
+            ddr.pre_reconnect.disconnect(count)
+        self.assertEqual(attempts, [1, 2])
+
+    def test_simulate_outage(self) -> None:
+        out = io.StringIO()
+        call_command("dbconn_simulate_outage", threads=2, duration=0.5, outage_start=0.1, outage_length=0.1,
+                     overrides=[("MAX_DBCONN_RETRY_TIMES", 20), ("DBCONN_RETRY_DELAY", 0.02)], stdout=out)
+        report = out.getvalue()
+        self.assertIn("failed requests:     0 (0.0%)", report)
+        self.assertRegex(report, r"time to recovery: +[0-9.]+ ms")
+
+
+class WrapEngineTests(TestCase):
+    """
+    Tests for retrying through the wrapping database engine instead of
+    monkeypatching Django.
+    """
+
+    def _settings_dict(self) -> Dict[str, Any]:
+        settings_dict = dict(connection.settings_dict)
+        settings_dict["WRAPPED_ENGINE"] = settings_dict["ENGINE"]
+        settings_dict["ENGINE"] = "django_dbconn_retry.backends.wrap"
+        return settings_dict
+
+    def test_connects(self) -> None:
+        dbwrapper = RetryWrapper(self._settings_dict(), "default")
+        self.assertIsInstance(dbwrapper, type(connections["default"]))
+        with patch.object(BaseDatabaseWrapper, "ensure_connection", _django_ensure_connection):
+            with dbwrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        dbwrapper.close()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=2)
+    def test_only_wrapped_databases_retry(self) -> None:
+        with patch.object(BaseDatabaseWrapper, "ensure_connection", _django_ensure_connection):
+            wrapped = RetryWrapper(self._settings_dict(), "default")
+            stock = connections.create_connection("default")
+            for dbwrapper in (wrapped, stock):
+                dbwrapper.connect = Mock(side_effect=OperationalError("connection refused"))  # type: ignore
+                self.assertRaises(OperationalError, dbwrapper.ensure_connection)
+        self.assertEqual(wrapped.connect.call_count, 3)
+        self.assertEqual(stock.connect.call_count, 1)
+
+    @override_settings(DBCONN_RETRY_MONKEYPATCH=False)
+    def test_ready_without_monkeypatch(self) -> None:
+        with patch.object(BaseDatabaseWrapper, "ensure_connection", _django_ensure_connection):
+            apps.get_app_config("django_dbconn_retry").ready()
+            self.assertIs(BaseDatabaseWrapper.ensure_connection, _django_ensure_connection)
+
+
+class RetryLogTests(TestCase):
+    """
+    Tests for the structured and rate-limited logging of failed connection
+    attempts.
+    """
+
+    def setUp(self) -> None:
+        reset_retry_logs()
+        self.dbwrapper = connections.create_connection("default")
+        self.error = OperationalError("connection refused")
+
+    def tearDown(self) -> None:
+        reset_retry_logs()
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=1)
+    def test_structured_records(self) -> None:
+        self.dbwrapper.connect = Mock(side_effect=self.error)  # type: ignore
+        with self.assertLogs("django_dbconn_retry.retrylog", logging.INFO) as logs:
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+        retrying, gave_up = logs.records
+        self.assertEqual((retrying.levelno, retrying.alias, retrying.attempt, retrying.delay),
+                         (logging.INFO, "default", 1, 0.0))
+        self.assertEqual(retrying.error_class, "django.db.utils.OperationalError")
+        self.assertEqual((gave_up.levelno, gave_up.attempt, gave_up.delay), (logging.ERROR, 1, None))
+
+    @patch('django_dbconn_retry.retrylog.time.monotonic')
+    def test_summarizes_within_interval(self, mock_monotonic: Mock) -> None:
+        retry_log = RetryLog("default", 10)
+        mock_monotonic.return_value = 100.0
+        with self.assertLogs("django_dbconn_retry.retrylog", logging.INFO) as logs:
+            for attempt in range(1, 5):
+                retry_log.retrying(self.dbwrapper, attempt, 0.0, self.error)
+            retry_log.gave_up(self.dbwrapper, "giving up %s", 5, self.error)
+            mock_monotonic.return_value = 111.0
+            retry_log.retrying(self.dbwrapper, 1, 0.0, self.error)
+        first, summary, after = logs.records
+        self.assertEqual(first.attempt, 1)
+        self.assertEqual(summary.getMessage(),
+                         "4 more failed connection attempts to database default within 10s, 1 of which gave up "
+                         "(django.db.utils.OperationalError: 4)")
+        self.assertEqual((summary.failed_attempts, summary.gave_up), (4, 1))
+        self.assertEqual(after.levelno, logging.INFO)
+
+    def test_flush(self) -> None:
+        retry_log = RetryLog("default", 10)
+        with self.assertLogs("django_dbconn_retry.retrylog", logging.INFO) as logs:
+            retry_log.retrying(self.dbwrapper, 1, 0.0, self.error)
+            retry_log.retrying(self.dbwrapper, 2, 0.0, self.error)
+            retry_log.flush()
+            retry_log.flush()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(logs.records[1].failed_attempts, 1)
+
+    @override_settings(DBCONN_RETRY_LOG_INTERVAL=60, MAX_DBCONN_RETRY_TIMES=0)
+    def test_flushed_on_reconnect(self) -> None:
+        self.dbwrapper.connect = Mock(side_effect=[self.error, self.error, None])  # type: ignore
+        with self.assertLogs("django_dbconn_retry.retrylog", logging.INFO) as logs:
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+            self.assertRaises(OperationalError, self.dbwrapper.ensure_connection)
+            self.dbwrapper.ensure_connection()
+        first, summary = logs.records
+        self.assertEqual(summary.failed_attempts, 1)
+
+    def test_without_interval(self) -> None:
+        retry_log = RetryLog("default")
+        with self.assertLogs("django_dbconn_retry.retrylog", logging.INFO) as logs:
+            for attempt in range(1, 4):
+                retry_log.retrying(self.dbwrapper, attempt, 0.0, self.error)
+        self.assertEqual([record.attempt for record in logs.records], [1, 2, 3])
+
+
+def rotated_credentials(alias: str) -> Dict[str, Any]:
+    return {"USER": "app", "PASSWORD": "rotated"}
+
+
+class CredentialProviderTests(TestCase):
+    """
+    Tests for refreshing credentials through a cached credential provider.
+    """
+
+    def setUp(self) -> None:
+        reset_credential_caches()
+        self.dbwrapper = connections.create_connection("default")
+        # don't change the settings of the other connections
+        self.dbwrapper.settings_dict = dict(self.dbwrapper.settings_dict)
+
+    def tearDown(self) -> None:
+        reset_credential_caches()
+
+    def test_caches_for_ttl(self) -> None:
+        provider = Mock(return_value={"PASSWORD": "secret"})
+        cache = CredentialCache("default", provider, 60)
+        self.assertEqual(cache.get(), {"PASSWORD": "secret"})
+        self.assertEqual(cache.get(), {"PASSWORD": "secret"})
+        self.assertEqual(provider.call_count, 1)
+        # the credentials were rejected by an attempt that started after they were fetched
+        cache.get(since=time.perf_counter())
+        self.assertEqual(provider.call_count, 2)
+        cache.ttl = 0
+        cache.get()
+        self.assertEqual(provider.call_count, 3)
+
+    def test_single_fetch_for_concurrent_threads(self) -> None:
+        def fetch(alias: str) -> Dict[str, Any]:
+            time.sleep(0.05)
+            return {"PASSWORD": "secret"}
+
+        provider = Mock(side_effect=fetch)
+        cache = CredentialCache("default", provider, 60)
+        threads = [threading.Thread(target=cache.get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        provider.assert_called_once_with("default")
+
+    def test_failing_provider(self) -> None:
+        cache = CredentialCache("default", Mock(side_effect=RuntimeError("vault is sealed")), 60)
+        with self.assertLogs("django_dbconn_retry.credentials", logging.WARNING):
+            self.assertIsNone(cache.get())
+        self.assertFalse(refresh_credentials(self.dbwrapper, Mock(side_effect=RuntimeError()), 60))
+
+    def test_only_changed_credentials_are_applied(self) -> None:
+        self.assertTrue(refresh_credentials(self.dbwrapper, rotated_credentials, 60))
+        self.assertEqual(self.dbwrapper.settings_dict["PASSWORD"], "rotated")
+        self.assertFalse(refresh_credentials(self.dbwrapper, rotated_credentials, 60))
+
+    @override_settings(MAX_DBCONN_RETRY_TIMES=1,
+                       DBCONN_RETRY_CREDENTIAL_PROVIDER="django_dbconn_retry.tests.rotated_credentials")
+    def test_refreshed_before_reconnecting(self) -> None:
+        passwords = []  # type: List[str]
+
+        def receiver(sender: Any, dbwrapper: BaseDatabaseWrapper, **kwargs: Any) -> None:
+            passwords.append(dbwrapper.settings_dict["PASSWORD"])
+
+        self.dbwrapper.connect = Mock(side_effect=[  # type: ignore
+            OperationalError('FATAL:  password authentication failed for user "app"'), None,
+        ])
+        ddr.pre_reconnect.connect(receiver)
+        try:
+            self.dbwrapper.ensure_connection()
+        finally:
+            ddr.pre_reconnect.disconnect(receiver)
+        self.assertEqual(passwords, ["rotated"])
+
+    @override_settings(DBCONN_RETRY_CREDENTIAL_PROVIDER="no.such.provider")
+    def test_invalid_provider(self) -> None:
+        with self.assertLogs("django_dbconn_retry.policy", logging.WARNING):
+            self.assertIsNone(ddr.get_retry_policy("default").credential_provider)
@@ -0,0 +1,11 @@
+from django.http import HttpRequest, HttpResponse
+
+from django_dbconn_retry.metrics import render_prometheus
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Serves the connection metrics of this process in the Prometheus text
+    format. Add it to your URLconf wherever your scraper expects it.
+    """
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,95 @@
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.utils import OperationalError
+
+from typing import Any, Dict, Iterable, NamedTuple, Optional  # noqa. flake8 #118
+
+
+_log = logging.getLogger(__name__)
+
+
+class WarmupResult(NamedTuple):
+    """
+    The outcome of warming up the connection to one database alias.
+    """
+    alias: str
+    elapsed: float
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _warm_up_connection(dbwrapper: BaseDatabaseWrapper) -> WarmupResult:
+    started = time.perf_counter()
+    try:
+        dbwrapper.ensure_connection()
+        if not dbwrapper.is_usable():
+            raise OperationalError("Connection to database %s is not usable." % dbwrapper.alias)
+    except Exception as e:
+        return WarmupResult(dbwrapper.alias, time.perf_counter() - started, e)
+    return WarmupResult(dbwrapper.alias, time.perf_counter() - started)
+
+
+def warm_up(aliases: Optional[Iterable[str]] = None) -> Dict[str, WarmupResult]:
+    """
+    Connects to the databases in ``aliases`` (all configured databases by
+    default) concurrently, using the normal retry logic, and checks that the
+    connections are usable. The connections belong to the calling thread, so
+    call this from the thread that will serve requests. Returns a
+    ``WarmupResult`` per alias.
+    """
+    dbwrappers = [connections[alias] for alias in (aliases if aliases is not None else connections)]
+    if not dbwrappers:
+        return {}
+    # each connection is used by exactly one pool thread while we wait for them
+    for dbwrapper in dbwrappers:
+        dbwrapper.inc_thread_sharing()
+    try:
+        with ThreadPoolExecutor(max_workers=len(dbwrappers), thread_name_prefix="dbconn-warmup") as pool:
+            results = list(pool.map(_warm_up_connection, dbwrappers))
+    finally:
+        for dbwrapper in dbwrappers:
+            dbwrapper.dec_thread_sharing()
+
+    for result in results:
+        if result.ok:
+            _log.info("Connected to database %s in %.3f seconds", result.alias, result.elapsed)
+        else:
+            _log.error("Connecting to database %s failed after %.3f seconds: %s", result.alias, result.elapsed,
+                       result.error)
+    return {result.alias: result for result in results}
+
+
+def _warm_up_worker() -> None:
+    # a worker that can't reach its databases mustn't report ready. gunicorn treats an exception in these hooks as
+    # a boot error and stops the worker.
+    failed = [result for result in warm_up().values() if not result.ok]
+    if failed:
+        raise OperationalError("Couldn't connect to %s." % ", ".join(result.alias for result in failed)) \
+            from failed[0].error
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    """
+    A gunicorn ``post_fork`` hook for servers that use ``preload_app``. Without
+    ``preload_app`` Django isn't set up yet when ``post_fork`` runs, so use
+    ``post_worker_init`` instead. Raises ``OperationalError`` if a database
+    can't be reached, which makes the worker fail to boot.
+    """
+    _warm_up_worker()
+
+
+def post_worker_init(worker: Any) -> None:
+    """
+    A gunicorn ``post_worker_init`` hook, which runs in the worker after it
+    loaded the application. Raises ``OperationalError`` if a database can't be
+    reached, which makes the worker fail to boot.
+    """
+    _warm_up_worker()
@@ -16,6 +16,11 @@ setup(
     version="0.3.1",
     packages=[
         'django_dbconn_retry',
+        'django_dbconn_retry.backends',
+        'django_dbconn_retry.backends.faultinjection',
+        'django_dbconn_retry.backends.wrap',
+        'django_dbconn_retry.management',
+        'django_dbconn_retry.management.commands',
         'django_dbconn_retry.tests',
     ],
     package_dir={